@@ -0,0 +1,134 @@
+"""Editing benchmarks for the case study Document, one run per storage backend.
+
+Each backend and document size runs in a fresh process so the peak RSS
+reported is that run's own. Typical use, from this directory:
+
+    python benchmark.py --sizes 10K,1M,100M --backends GapBuffer,StyledText
+"""
+import argparse
+import os
+import random
+import resource
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+from case_study import Document, GapBuffer, StyledText
+
+BACKENDS = {'list': list, 'GapBuffer': GapBuffer, 'StyledText': StyledText}
+UNITS = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+LINE = 'The quick brown fox jumps over the lazy dog, again and again.\n'
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    if text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+def make_document(backend, size):
+    document = Document(BACKENDS[backend])
+    document.insert_text((LINE * (size // len(LINE) + 1))[:size])
+    document.cursor.position = 0
+    return document
+
+
+def random_inserts(document, rng, count):
+    for _ in range(count):
+        document.cursor.position = rng.randrange(len(document) + 1)
+        document.insert('x')
+    return count
+
+
+def typing_bursts(document, rng, count, burst=50):
+    for _ in range(count // burst):
+        document.cursor.position = rng.randrange(len(document) + 1)
+        for character in 'typing in the middle of a line, word after word.'[:burst]:
+            document.insert(character)
+    return count // burst * burst
+
+
+def navigation(document, rng, count):
+    lines = len(document.lines)
+    for _ in range(count // 3):
+        document.cursor.goto_line(rng.randrange(lines))
+        document.cursor.end()
+        document.cursor.home()
+    return count // 3 * 3
+
+
+def renders(document, rng, count):
+    for _ in range(count):
+        document.cursor.position = rng.randrange(len(document) + 1)
+        document.insert('x')
+        document.string
+    return count
+
+
+def save(document, rng, count):
+    with tempfile.TemporaryDirectory() as directory:
+        document.filename = os.path.join(directory, 'bench.txt')
+        for _ in range(count):
+            document.save()
+    return count
+
+
+TRACES = [
+    ('random inserts', random_inserts, 2000),
+    ('typing bursts', typing_bursts, 5000),
+    ('home/end/goto', navigation, 3000),
+    ('render', renders, 50),
+    ('save', save, 3),
+]
+
+
+def run(backend, size, seed=0):
+    """Time every trace on one backend, then measure its memory"""
+    rng = random.Random(seed)
+    results = {}
+    start = time.perf_counter()
+    document = make_document(backend, size)
+    results['load'] = size / (time.perf_counter() - start)
+    for name, trace, count in TRACES:
+        start = time.perf_counter()
+        done = trace(document, rng, count)
+        results[name] = done / (time.perf_counter() - start)
+    del document
+
+    tracemalloc.start()
+    document = make_document(backend, size)
+    typing_bursts(document, rng, 1000)
+    traced = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    # ru_maxrss is in kilobytes on Linux
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return backend, size, results, traced, rss
+
+
+def megabytes(count):
+    return f'{count / (1 << 20):.1f} MB'
+
+
+def report(backend, size, results, traced, rss):
+    print(f'{backend} {megabytes(size)}')
+    print(f'    {"load":<16}{results["load"]:>14,.0f} chars/sec')
+    for name, _, _ in TRACES:
+        print(f'    {name:<16}{results[name]:>14,.1f} ops/sec')
+    print(f'    peak traced {megabytes(traced)}, peak RSS {megabytes(rss)}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10K,100K,1M',
+                        help='comma separated document sizes, e.g. 10K,100M')
+    parser.add_argument('--backends', default=','.join(BACKENDS),
+                        help='comma separated storage backends')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for size in (parse_size(size) for size in args.sizes.split(',')):
+        for backend in args.backends.split(','):
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                report(*pool.submit(run, backend, size, args.seed).result())
@@ -1,25 +1,1100 @@
-class Document:
+import codecs
+import mmap
+import os
+import re
+import time
+from collections import deque
+from contextlib import contextmanager
+from itertools import accumulate, groupby
+from operator import attrgetter
+from array import array, typecodes
+from bisect import bisect_left, bisect_right
+
+# 'u' is deprecated from 3.13 on in favour of 'w', both hold one code point
+TEXT_TYPECODE = 'w' if 'w' in typecodes else 'u'
+PLAIN = (False, False, False)
+# Bytes read from a mapped file, or glyphs written by save, per step
+CHUNK_SIZE = 1 << 20
+
+
+class GapBuffer:
+    """A list-like sequence that keeps a gap of free slots at the last edit.
+
+    Inserting or deleting next to the previous edit only touches the gap, so
+    typing in the middle of a big document is amortized O(1) instead of
+    shifting every element after the cursor like list.insert does. Moving the
+    edit point costs O(distance moved), or one memmove of the buffer for
+    jumps further than far_move.
+    """
+    far_move = 4096
+
+    def __init__(self, items=(), gap_size=64, container=list, filler=None):
+        self.container = container
+        self.filler = filler
+        self.gap_size = gap_size
+        items = container(items)
+        self._gap_start = len(items)
+        self._gap_end = self._gap_start + gap_size
+        self._buffer = items + self._blank(gap_size)
+
+    def __len__(self):
+        return len(self._buffer) - (self._gap_end - self._gap_start)
+
+    def __iter__(self):
+        buffer = self._buffer
+        for i in range(self._gap_start):
+            yield buffer[i]
+        for i in range(self._gap_end, len(buffer)):
+            yield buffer[i]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return self.container(self[i] for i in range(start, stop, step))
+            stop = max(start, stop)
+            gap = self._gap_end - self._gap_start
+            if stop <= self._gap_start:
+                return self._buffer[start:stop]
+            if start >= self._gap_start:
+                return self._buffer[start + gap:stop + gap]
+            return (
+                self._buffer[start:self._gap_start]
+                + self._buffer[self._gap_end:stop + gap]
+            )
+        return self._buffer[self._physical(index)]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError('GapBuffer only supports contiguous slices')
+            del self[start:stop]
+            self._insert_items(start, self.container(value))
+        else:
+            self._buffer[self._physical(index)] = value
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError('GapBuffer only supports contiguous slices')
+        else:
+            start = self._normalize(index)
+            stop = start + 1
+        if stop <= start:
+            return
+        self._move_gap(start)
+        old_end = self._gap_end
+        self._gap_end += stop - start
+        # Drop references held by the deleted slots
+        self._buffer[old_end:self._gap_end] = self._blank(stop - start)
+
+    def __repr__(self):
+        return f'GapBuffer({list(self)!r})'
+
+    def insert(self, index, item):
+        length = len(self)
+        if index < 0:
+            index = max(0, index + length)
+        index = min(index, length)
+        self._move_gap(index)
+        if self._gap_start == self._gap_end:
+            self._grow(1)
+        self._buffer[self._gap_start] = item
+        self._gap_start += 1
+
+    def append(self, item):
+        self.insert(len(self), item)
+
+    def _insert_items(self, index, items):
+        count = len(items)
+        if not count:
+            return
+        self._move_gap(index)
+        if self._gap_end - self._gap_start < count:
+            self._grow(count)
+        self._buffer[self._gap_start:self._gap_start + count] = items
+        self._gap_start += count
+
+    def _blank(self, size):
+        return self.container([self.filler]) * size
+
+    def _normalize(self, index):
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('GapBuffer index out of range')
+        return index
+
+    def _physical(self, index):
+        index = self._normalize(index)
+        if index >= self._gap_start:
+            index += self._gap_end - self._gap_start
+        return index
+
+    def _move_gap(self, index):
+        buffer = self._buffer
+        start, end = self._gap_start, self._gap_end
+        if abs(index - start) > self.far_move:
+            # Far jumps are cheaper as two memmoves than an element-wise
+            # copy, and a gap left huge by a bulk insert is trimmed on the way
+            gap = min(end - start, max(self.gap_size, self.far_move))
+            del buffer[start:end]
+            buffer[index:index] = self._blank(gap)
+            self._gap_start, self._gap_end = index, index + gap
+        elif index < start:
+            count = start - index
+            buffer[end - count:end] = buffer[index:start]
+            self._gap_start, self._gap_end = index, end - count
+            vacated = min(start, self._gap_end) - index
+            buffer[index:index + vacated] = self._blank(vacated)
+        elif index > start:
+            count = index - start
+            buffer[start:start + count] = buffer[end:end + count]
+            self._gap_start, self._gap_end = index, end + count
+            vacated_start = max(end, self._gap_start)
+            buffer[vacated_start:self._gap_end] = self._blank(
+                self._gap_end - vacated_start)
+
+    def _grow(self, needed):
+        # Double the storage so repeated inserts stay amortized O(1)
+        extra = max(needed, len(self), self.gap_size)
+        self._buffer[self._gap_end:self._gap_end] = self._blank(extra)
+        self._gap_end += extra
+
+
+def text_array(items=()):
+    return array(TEXT_TYPECODE, items)
+
+
+def render(characters, start, end):
+    """Render characters[start:end] using the storage's fast path if any"""
+    if hasattr(characters, 'render'):
+        return characters.render(start, end)
+    return ''.join(str(c) for c in characters[start:end])
+
+
+class StyledText:
+    """Compact storage: one text buffer plus run-length formatting spans.
+
+    The text lives in a GapBuffer over an array of code points (4 bytes a
+    character) and formatting is kept as sorted run starts with one
+    (bold, italic, underline) tuple per run, so plain text costs a single
+    run. Character objects are built on access; they are copies, so use
+    restyle to change formatting.
+    """
+    def __init__(self, gap_size=4096):
+        self.text = GapBuffer(container=text_array, filler='\0',
+                              gap_size=gap_size)
+        self._starts = []
+        self._styles = []
+
+    @classmethod
+    def from_runs(cls, runs, gap_size=4096):
+        """Build storage from [text, style] runs in one go"""
+        storage = cls(gap_size)
+        texts = []
+        position = 0
+        for text, style in runs:
+            if not text:
+                continue
+            if not storage._styles or storage._styles[-1] != style:
+                storage._starts.append(position)
+                storage._styles.append(tuple(style))
+            texts.append(text)
+            position += len(text)
+        storage.text = GapBuffer(''.join(texts), container=text_array,
+                                 filler='\0', gap_size=gap_size)
+        return storage
+
+    def __len__(self):
+        return len(self.text)
+
+    def __iter__(self):
+        run = 0
+        for position, character in enumerate(self.text):
+            while run + 1 < len(self._starts) and self._starts[run + 1] <= position:
+                run += 1
+            yield Character(character, *self._styles[run])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        character = self.text[index]
+        if index < 0:
+            index += len(self)
+        return Character(character, *self.style_at(index))
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError('StyledText only supports contiguous slices')
+        else:
+            start = index + len(self) if index < 0 else index
+            stop = start + 1
+            if not 0 <= start < len(self):
+                raise IndexError('StyledText index out of range')
+        if stop <= start:
+            return
+        self._delete_styles(start, stop)
+        del self.text[start:stop]
+
+    def insert(self, index, character):
+        if not hasattr(character, 'character'):
+            character = Character(character)
+        index = max(0, min(index + len(self) if index < 0 else index,
+                           len(self)))
+        self.insert_text(index, character.character, character.style)
+
+    def insert_text(self, index, text, style=PLAIN):
+        if not text:
+            return
+        self._insert_style(index, len(text), tuple(style))
+        self.text[index:index] = text
+
+    def render(self, start, end):
+        """Render start:end without building a Character per glyph"""
+        parts = []
+        run = bisect_right(self._starts, start) - 1
+        while start < end:
+            stop = end
+            if run + 1 < len(self._starts):
+                stop = min(stop, self._starts[run + 1])
+            text = self.text[start:stop].tounicode()
+            prefix = str(Character(' ', *self._styles[run]))[:-1]
+            if prefix:
+                text = ''.join(prefix + c for c in text)
+            parts.append(text)
+            start = stop
+            run += 1
+        return ''.join(parts)
+
+    def runs(self, start, end):
+        """The text in start:end as [text, style] runs"""
+        runs = []
+        run = bisect_right(self._starts, start) - 1
+        while start < end:
+            stop = end
+            if run + 1 < len(self._starts):
+                stop = min(stop, self._starts[run + 1])
+            runs.append([self.text[start:stop].tounicode(), self._styles[run]])
+            start = stop
+            run += 1
+        return runs
+
+    def style_at(self, index):
+        return self._styles[bisect_right(self._starts, index) - 1]
+
+    def restyle(self, start, end, style):
+        """Apply one style to every character in start:end"""
+        if end <= start:
+            return
+        first = self._split(start)
+        last = self._split(end)
+        del self._starts[first + 1:last]
+        del self._styles[first + 1:last]
+        self._styles[first] = tuple(style)
+        self._merge(first)
+
+    def _split(self, position):
+        """Make a run start at position and return its index"""
+        if position >= len(self):
+            return len(self._starts)
+        run = bisect_right(self._starts, position) - 1
+        if self._starts[run] == position:
+            return run
+        self._starts.insert(run + 1, position)
+        self._styles.insert(run + 1, self._styles[run])
+        return run + 1
+
+    def _merge(self, run):
+        if run + 1 < len(self._styles) and self._styles[run + 1] == self._styles[run]:
+            del self._starts[run + 1]
+            del self._styles[run + 1]
+        if 0 < run < len(self._styles) and self._styles[run - 1] == self._styles[run]:
+            del self._starts[run]
+            del self._styles[run]
+
+    def _insert_style(self, index, count, style):
+        run = self._split(index)
+        for i in range(run, len(self._starts)):
+            self._starts[i] += count
+        self._starts.insert(run, index)
+        self._styles.insert(run, style)
+        self._merge(run)
+
+    def _delete_styles(self, start, end):
+        first = self._split(start)
+        last = self._split(end)
+        del self._starts[first:last]
+        del self._styles[first:last]
+        for i in range(first, len(self._starts)):
+            self._starts[i] -= end - start
+        if first < len(self._styles):
+            self._merge(first)
+        elif first:
+            self._merge(first - 1)
+
+
+class RenderCache:
+    """Rendered document text, cached in chunks of about chunk_size glyphs.
+
+    Chunks store their length rather than their offset, so an edit only
+    throws away the chunk it lands in; the chunks after it keep their
+    rendered text even though their positions have moved.
+    """
+    def __init__(self, chunk_size=4096):
+        self.chunk_size = chunk_size
+        self.hits = 0
+        self.misses = 0
+        # [length, rendered text or None when dirty]
+        self._chunks = []
+        self._string = ''
+
+    def edit(self, position, delta):
+        """Record that delta glyphs were inserted (or removed) at position"""
+        if not delta:
+            return
+        self._string = None
+        if delta > 0:
+            if not self._chunks:
+                self._chunks.append([0, None])
+            index, _ = self._find(position)
+            chunk = self._chunks[index]
+            chunk[0] += delta
+            chunk[1] = None
+            return
+        remaining = -delta
+        index, offset = self._find(position, deleting=True)
+        while remaining:
+            chunk = self._chunks[index]
+            removed = min(remaining, chunk[0] - offset)
+            chunk[0] -= removed
+            chunk[1] = None
+            remaining -= removed
+            if chunk[0]:
+                index += 1
+            else:
+                del self._chunks[index]
+            offset = 0
+
+    def replace(self, edits):
+        """Record many (start, end, inserted) edits in one pass over the chunks.
+
+        The edits must be sorted and not overlap, with start and end given
+        as positions before any of them were applied.
+        """
+        if not edits:
+            return
+        self._string = None
+        if not self._chunks:
+            self._chunks = [[sum(inserted for _, _, inserted in edits), None]]
+            return
+        chunks = []
+        offset = 0
+        index = 0
+        last = len(self._chunks) - 1
+        for number, (length, text) in enumerate(self._chunks):
+            end = offset + length
+            new_length = length
+            while index < len(edits):
+                start, stop, inserted = edits[index]
+                if start > end or (start == end and number != last):
+                    break
+                new_length -= max(0, min(stop, end) - max(start, offset))
+                if start >= offset:
+                    new_length += inserted
+                text = None
+                if stop > end:
+                    # The deletion carries on into the next chunk
+                    break
+                index += 1
+            if new_length:
+                chunks.append([new_length, text])
+            offset = end
+        self._chunks = chunks
+
+    def render(self, characters):
+        if self._string is not None:
+            self.hits += 1
+            return self._string
+        parts = []
+        start = 0
+        chunks = []
+        for length, text in self._chunks:
+            if text is None:
+                self.misses += 1
+                # Split chunks that grew from typing back down to size
+                for chunk_start in range(start, start + length, self.chunk_size):
+                    chunk_end = min(chunk_start + self.chunk_size, start + length)
+                    text = render(characters, chunk_start, chunk_end)
+                    chunks.append([chunk_end - chunk_start, text])
+                    parts.append(text)
+            else:
+                self.hits += 1
+                chunks.append([length, text])
+                parts.append(text)
+            start += length
+        self._chunks = chunks
+        self._string = ''.join(parts)
+        return self._string
+
+    def invalidate(self, start, end):
+        """Mark the chunks holding start:end dirty, their text has changed"""
+        if end <= start:
+            return
+        self._string = None
+        offset = 0
+        for chunk in self._chunks:
+            if offset >= end:
+                break
+            if offset + chunk[0] > start:
+                chunk[1] = None
+            offset += chunk[0]
+
+    def clear(self):
+        """Mark every chunk dirty"""
+        for chunk in self._chunks:
+            chunk[1] = None
+        self._string = None
+
+    def _find(self, position, deleting=False):
+        """Chunk index holding position, and position's offset inside it"""
+        for index, (length, text) in enumerate(self._chunks):
+            if position < length or (position == length and not deleting):
+                return index, position
+            position -= length
+        raise IndexError('RenderCache position out of range')
+
+
+class LineIndex:
+    """Offsets of every newline in a document, kept up to date by edits.
+
+    Works like the gap buffer: newlines before the last edit point are
+    stored as absolute offsets, newlines after it as their distance from the
+    end of the document. An edit at the edit point therefore never has to
+    renumber the lines after it, and lookups are a bisect, O(log n). The
+    offsets are packed in arrays, 8 bytes a line.
+    """
     def __init__(self):
-        self.characters = []
+        self.length = 0
+        self._before = array('q')
+        # Distances from the end; the newline nearest the gap is last
+        self._after = array('q')
+
+    def __len__(self):
+        """Number of lines, an empty document has one"""
+        return len(self._before) + len(self._after) + 1
+
+    def insert(self, position, text):
+        self._move_to(position)
+        self.length += len(text)
+        offset = text.find('\n')
+        while offset != -1:
+            self._before.append(position + offset)
+            offset = text.find('\n', offset + 1)
+
+    def delete(self, start, end):
+        self._move_to(start)
+        while self._after and self.length - self._after[-1] < end:
+            self._after.pop()
+        self.length -= end - start
+
+    def line_of(self, position):
+        """Zero based line number containing position"""
+        count = bisect_left(self._before, position)
+        if count < len(self._before):
+            return count
+        return count + len(self._after) - bisect_right(
+            self._after, self.length - position)
+
+    def line_start(self, line):
+        line = min(line, len(self) - 1)
+        if line <= 0:
+            return 0
+        return self._newline(line - 1) + 1
+
+    def line_end(self, line):
+        """Position of the newline ending line, or the end of the document"""
+        if line >= len(self) - 1:
+            return self.length
+        return self._newline(max(line, 0))
+
+    def _newline(self, number):
+        if number < len(self._before):
+            return self._before[number]
+        number -= len(self._before)
+        return self.length - self._after[len(self._after) - 1 - number]
+
+    def _move_to(self, position):
+        before, after, length = self._before, self._after, self.length
+        count = len(before) - bisect_left(before, position)
+        if count:
+            after.extend([length - offset for offset in reversed(before[-count:])])
+            del before[-count:]
+        count = bisect_right(after, length - position)
+        if count < len(after):
+            before.extend([length - distance for distance in reversed(after[count:])])
+            del after[count:]
+
+
+class Edit:
+    """One undoable step: text inserted at, or deleted from, position.
+
+    The text is kept as [text, style] runs so undoing a delete restores
+    the formatting too.
+    """
+    __slots__ = ('kind', 'position', 'runs', 'length', 'time')
+
+    def __init__(self, kind, position, runs):
+        self.kind = kind
+        self.position = position
+        self.runs = []
+        self.length = 0
+        self.time = time.monotonic()
+        self.add(runs)
+
+    def add(self, runs, front=False):
+        for text, style in (reversed(runs) if front else runs):
+            index = 0 if front else -1
+            if self.runs and self.runs[index][1] == style:
+                self.runs[index][0] = (
+                    text + self.runs[index][0] if front
+                    else self.runs[index][0] + text)
+            elif front:
+                self.runs.insert(0, [text, style])
+            else:
+                self.runs.append([text, style])
+            self.length += len(text)
+        self.time = time.monotonic()
+
+
+class EditGroup:
+    """Several Edits undone and redone as one step, kept in applied order"""
+    kind = 'group'
+
+    def __init__(self, edits):
+        self.edits = edits
+        self.length = sum(edit.length for edit in edits)
+
+
+class Journal:
+    """Undo and redo history made of compact insert and delete deltas.
+
+    Consecutive keystrokes typed (or deleted) in one place are coalesced
+    into one Edit until a checkpoint: an explicit checkpoint() call, a
+    pause longer than coalesce_timeout, or the Edit reaching
+    checkpoint_every characters. Once the history holds more than
+    max_chars characters the oldest steps are dropped.
+    """
+    def __init__(self, max_chars=1 << 20, coalesce_timeout=1.0,
+                 checkpoint_every=256):
+        self.max_chars = max_chars
+        self.coalesce_timeout = coalesce_timeout
+        self.checkpoint_every = checkpoint_every
+        self.size = 0
+        self._undo = deque()
+        self._redo = []
+        self._sealed = True
+
+    def record(self, kind, position, runs):
+        self._clear_redo()
+        last = self._undo[-1] if self._undo else None
+        if last and self._can_coalesce(last, kind, position):
+            if kind == 'insert' or position == last.position:
+                last.add(runs)
+            else:
+                # Backspacing: the new text sits in front of the old
+                last.add(runs, front=True)
+                last.position = position
+        else:
+            self._undo.append(Edit(kind, position, runs))
+            self._sealed = False
+        self.size += sum(len(text) for text, style in runs)
+        self._trim()
+
+    def record_group(self, edits):
+        if not edits:
+            return
+        self._clear_redo()
+        group = EditGroup(edits)
+        self._undo.append(group)
+        self.size += group.length
+        self._sealed = True
+        self._trim()
+
+    def checkpoint(self):
+        self._sealed = True
+
+    def undo(self):
+        if not self._undo:
+            return None
+        edit = self._undo.pop()
+        self._redo.append(edit)
+        self._sealed = True
+        return edit
+
+    def redo(self):
+        if not self._redo:
+            return None
+        edit = self._redo.pop()
+        self._undo.append(edit)
+        self._sealed = True
+        return edit
+
+    def _clear_redo(self):
+        while self._redo:
+            self.size -= self._redo.pop().length
+
+    def _trim(self):
+        while self.size > self.max_chars and len(self._undo) > 1:
+            self.size -= self._undo.popleft().length
+
+    def _can_coalesce(self, last, kind, position):
+        if self._sealed or last.kind != kind:
+            return False
+        if last.length >= self.checkpoint_every:
+            return False
+        if time.monotonic() - last.time > self.coalesce_timeout:
+            return False
+        if kind == 'insert':
+            return position == last.position + last.length
+        return position == last.position or position + 1 == last.position
+
+
+class Document:
+    def __init__(self, storage=GapBuffer):
+        self._characters = storage()
+        self._lines = LineIndex()
+        self._source = None
+        self._source_path = None
+        # Whether _lines already covers a source that is not loaded yet
+        self._source_indexed = False
+        self.render_cache = RenderCache()
+        self.journal = Journal()
         self.cursor = Cursor(self)
+        self.cursors = [self.cursor]
         self.filename = ''
+        self.encoding = None
+
+    @classmethod
+    def load(cls, path, storage=StyledText, encoding='utf-8'):
+        """Open a file without reading it.
+
+        The file is memory mapped. Moving the cursors around only streams
+        over it to index the lines, which costs 8 bytes a line. It is decoded
+        into storage the first time the document is edited or characters is
+        used, one chunk at a time. That holds the whole text, so prefer the
+        compact StyledText for big files: GapBuffer builds an object per
+        character.
+        """
+        document = cls(storage)
+        document.filename = document._source_path = str(path)
+        document.encoding = encoding
+        with open(path, 'rb') as f:
+            if f.seek(0, 2):
+                document._source = mmap.mmap(f.fileno(), 0,
+                                             access=mmap.ACCESS_READ)
+        return document
+
+    def __len__(self):
+        if self._source is not None:
+            return self.lines.length
+        return len(self._characters)
+
+    @property
+    def characters(self):
+        """The storage, handed out to be read or changed in place.
+
+        The render cache cannot see changes made through it, such as
+        setting bold on a Character or StyledText.restyle, so it is cleared.
+        Use restyle, or the other Document methods, to keep it warm.
+        """
+        self._load()
+        self.render_cache.clear()
+        return self._characters
+
+    @property
+    def lines(self):
+        if self._source is not None and not self._source_indexed:
+            for text in self._decode_source():
+                self._lines.insert(self._lines.length, text)
+            self._source_indexed = True
+        return self._lines
 
     @property
     def string(self):
-        return ''.join((str(c) for c in self.characters))
+        if self._source is not None:
+            return ''.join(self._decode_source())
+        self._load()
+        return self.render_cache.render(self._characters)
 
     def insert(self, character):
         if not hasattr(character, 'character'):
             character = Character(character)
-        self.characters.insert(self.cursor.position, character)
-        self.cursor.forward()
+        self._load()
+        # Cursors can be moved forward past the end, insert there appends
+        self.cursor.position = min(self.cursor.position, len(self._characters))
+        self._characters.insert(self.cursor.position, character)
+        self.lines.insert(self.cursor.position, character.character)
+        self.render_cache.edit(self.cursor.position, 1)
+        self.journal.record('insert', self.cursor.position,
+                            [(character.character, character.style)])
+        if len(self.cursors) == 1:
+            self.cursor.forward()
+        else:
+            self._shift_cursors([(self.cursor.position, self.cursor.position,
+                                  character.character, None)])
 
     def delete(self):
-        del self.characters[self.cursor.position]
+        self._load()
+        runs = self._runs(self.cursor.position, self.cursor.position + 1)
+        del self._characters[self.cursor.position]
+        self.lines.delete(self.cursor.position, self.cursor.position + 1)
+        self.render_cache.edit(self.cursor.position, -1)
+        self.journal.record('delete', self.cursor.position, runs)
+        if len(self.cursors) > 1:
+            self._shift_cursors([(self.cursor.position,
+                                  self.cursor.position + 1, '', None)])
+
+    def insert_text(self, text, style=None):
+        """Insert a whole string at the cursor and move past it"""
+        self._load()
+        style = tuple(style or PLAIN)
+        position = self.cursor.position = min(self.cursor.position,
+                                              len(self._characters))
+        self._splice(position, text, style)
+        if text:
+            self.journal.checkpoint()
+            self.journal.record('insert', position, [(text, style)])
+            self.journal.checkpoint()
+
+    def delete_range(self, start, end):
+        """Delete the characters in start:end in one operation"""
+        self._load()
+        start = max(0, start)
+        end = min(end, len(self._characters))
+        if end <= start:
+            return
+        self.journal.checkpoint()
+        self.journal.record('delete', start, self._runs(start, end))
+        self.journal.checkpoint()
+        self._remove(start, end)
+
+    def restyle(self, start, end, style):
+        """Give start:end one style, as a single undo step"""
+        self._load()
+        start = max(0, start)
+        end = min(end, len(self._characters))
+        if end <= start:
+            return
+        style = tuple(style)
+        runs = self._runs(start, end)
+        text = ''.join(text for text, _ in runs)
+        if hasattr(self._characters, 'restyle'):
+            self._characters.restyle(start, end, style)
+        else:
+            for character in self._characters[start:end]:
+                character.bold, character.italic, character.underline = style
+        self.render_cache.invalidate(start, end)
+        self.journal.record_group([Edit('delete', start, runs),
+                                   Edit('insert', start, [(text, style)])])
+
+    def add_cursor(self, position=0):
+        """Add another cursor, edit_batch edits at all of them at once"""
+        cursor = Cursor(self)
+        cursor.position = position
+        self.cursors.append(cursor)
+        return cursor
+
+    def clear_cursors(self):
+        """Drop every cursor except the main one"""
+        del self.cursors[1:]
+
+    @contextmanager
+    def edit_batch(self):
+        """Queue edits at many cursors and apply them together on exit.
+
+        Positions are all taken from the document as it was when the batch
+        started. On exit the edits are sorted, overlapping deletions are
+        merged and everything is applied in one pass, then each cursor is
+        moved once.
+        """
+        batch = EditBatch(self)
+        yield batch
+        self._apply_edits(batch.edits())
+
+    def undo(self):
+        """Revert the last journal step, returns False if there was none"""
+        edit = self.journal.undo()
+        if edit is None:
+            return False
+        self._revert(edit)
+        return True
+
+    def redo(self):
+        edit = self.journal.redo()
+        if edit is None:
+            return False
+        self._replay(edit)
+        return True
+
+    @property
+    def text(self):
+        """The plain text, without the formatting marks string adds"""
+        if self._source is not None:
+            return ''.join(self._decode_source())
+        self._load()
+        characters = self._characters
+        if hasattr(characters, 'text'):
+            return characters.text[:].tounicode()
+        return ''.join(c.character for c in characters)
+
+    def find(self, pattern, flags=0):
+        """Lazily yield regex matches, match offsets are document positions.
+
+        The matches are taken from a snapshot of the text, so edits made
+        while iterating are not seen.
+        """
+        return re.compile(pattern, flags).finditer(self.text)
+
+    def replace_all(self, pattern, repl, flags=0):
+        """Replace every match in one sweep and return the replacement count.
+
+        repl is a template like re.sub takes, or a function of the match.
+        The replacements are a single undo step and take the style of the
+        text they replace.
+        """
+        edits = []
+        literal = isinstance(repl, str) and '\\' not in repl
+        for match in self.find(pattern, flags):
+            if literal:
+                text = repl
+            else:
+                text = repl(match) if callable(repl) else match.expand(repl)
+            if match.start() != match.end() or text:
+                edits.append((match.start(), match.end(), text, None))
+        self._apply_edits(edits)
+        return len(edits)
+
+    def line_of(self, position):
+        return self.lines.line_of(position)
+
+    def save(self, chunk_size=CHUNK_SIZE):
+        """Write the document out chunk by chunk, never as one big string"""
+        if self._source is not None:
+            # Still an untouched copy of the file on disk
+            if (os.path.exists(self.filename)
+                    and os.path.samefile(self.filename, self._source_path)):
+                return
+            chunks = self._decode_source()
+        else:
+            self._load()
+            characters = self._characters
+            chunks = (
+                render(characters, start, min(start + chunk_size, len(characters)))
+                for start in range(0, len(characters), chunk_size)
+            )
+        with open(self.filename, 'w', encoding=self.encoding,
+                  errors='surrogateescape') as f:
+            for chunk in chunks:
+                f.write(chunk)
+
+    def _decode_source(self, source=None):
+        if source is None:
+            source = self._source
+        decoder = codecs.getincrementaldecoder(self.encoding)(
+            errors='surrogateescape')
+        for offset in range(0, len(source), CHUNK_SIZE):
+            yield decoder.decode(source[offset:offset + CHUNK_SIZE])
+        yield decoder.decode(b'', final=True)
+
+    def _load(self):
+        if self._source is None:
+            return
+        source, self._source = self._source, None
+        # Indexed again below, along with the storage
+        self._lines = LineIndex()
+        self._source_indexed = False
+        # Cursors may already have been moved around the unloaded text, and
+        # stay where they are
+        for text in self._decode_source(source):
+            if text:
+                self.render_cache.edit(len(self._characters), len(text))
+                self._store(len(self._characters), text, PLAIN)
+        source.close()
+
+    def _splice(self, position, text, style=PLAIN):
+        """Insert a whole string at position in one storage operation"""
+        if not text:
+            return
+        self._store(position, text, style)
+        self.render_cache.edit(position, len(text))
+        self._shift_cursors([(position, position, text, style)])
+
+    def _store(self, position, text, style):
+        if hasattr(self._characters, 'insert_text'):
+            self._characters.insert_text(position, text, style)
+        else:
+            self._characters[position:position] = [
+                Character(c, *style) for c in text]
+        self._lines.insert(position, text)
+
+    def _apply_edits(self, edits):
+        """Apply sorted, non-overlapping (start, end, text, style) edits.
+
+        The storage is rebuilt once from the untouched stretches between
+        edits and the new text, rather than spliced once per edit. Positions
+        are as they were before any edit was applied, and a style of None
+        takes the style of the replaced text.
+        """
+        if not edits:
+            return
+        self._load()
+        old = self._characters
+        compact = hasattr(old, 'runs')
+        pieces = []
+        steps = []
+        previous = 0
+        for start, end, text, style in edits:
+            style = tuple(style or self._style_at(start))
+            steps.append((Edit('delete', start, self._runs(start, end)),
+                          Edit('insert', start, [(text, style)])))
+            if compact:
+                pieces.extend(old.runs(previous, start))
+                pieces.append((text, style))
+            else:
+                pieces.extend(old[previous:start])
+                pieces.extend(Character(c, *style) for c in text)
+            previous = end
+        if compact:
+            pieces.extend(old.runs(previous, len(old)))
+            self._characters = type(old).from_runs(pieces)
+        else:
+            pieces.extend(old[previous:])
+            self._characters = type(old)(pieces)
+        # Going from the back keeps the line index's edit point moving one way
+        for start, end, text, _ in reversed(edits):
+            self._lines.delete(start, end)
+            self._lines.insert(start, text)
+        self.render_cache.replace(
+            [(start, end, len(text)) for start, end, text, _ in edits])
+        # Replaying back to front keeps every recorded position valid
+        self.journal.record_group([
+            edit for step in reversed(steps) for edit in step if edit.length])
+        self._shift_cursors(edits)
+
+    def _shift_cursors(self, edits):
+        """Move every cursor to where it ends up after sorted edits.
+
+        A cursor inside a replaced stretch moves to the end of the new
+        text. Each cursor costs a bisect, O(log n) in the number of edits.
+        """
+        ends = [end for _, end, _, _ in edits]
+        deltas = list(accumulate(
+            (len(text) - (end - start) for start, end, text, _ in edits),
+            initial=0))
+        for cursor in self.cursors:
+            index = bisect_right(ends, cursor.position)
+            if index < len(edits) and edits[index][0] < cursor.position:
+                start, end, text, _ = edits[index]
+                cursor.position = start + len(text) + deltas[index]
+            else:
+                cursor.position += deltas[index]
+
+    def _revert(self, edit):
+        if edit.kind == 'group':
+            for part in reversed(edit.edits):
+                self._revert(part)
+        elif edit.kind == 'insert':
+            self._remove(edit.position, edit.position + edit.length)
+            self.cursor.position = edit.position
+        else:
+            self._restore(edit)
+
+    def _replay(self, edit):
+        if edit.kind == 'group':
+            for part in edit.edits:
+                self._replay(part)
+        elif edit.kind == 'insert':
+            self._restore(edit)
+        else:
+            self._remove(edit.position, edit.position + edit.length)
+            self.cursor.position = edit.position
+
+    def _restore(self, edit):
+        position = edit.position
+        for text, style in edit.runs:
+            self._splice(position, text, style)
+            position += len(text)
+        self.cursor.position = position
 
-    def save(self):
-        with open(self.filename, 'w') as f:
-            f.write(''.join(self.characters))
+    def _style_at(self, position):
+        characters = self._characters
+        if position >= len(characters):
+            return PLAIN
+        if hasattr(characters, 'style_at'):
+            return characters.style_at(position)
+        return characters[position].style
+
+    def _runs(self, start, end):
+        """The text in start:end as [text, style] runs"""
+        if hasattr(self._characters, 'runs'):
+            return self._characters.runs(start, end)
+        return [
+            [''.join(c.character for c in group), style]
+            for style, group in groupby(self._characters[start:end],
+                                        key=attrgetter('style'))
+        ]
+
+    def _remove(self, start, end):
+        del self._characters[start:end]
+        self._lines.delete(start, end)
+        self.render_cache.edit(start, start - end)
+        self._shift_cursors([(start, end, '', None)])
+
+
+class EditBatch:
+    """Edits queued by Document.edit_batch, one per cursor per call"""
+    def __init__(self, document):
+        self.document = document
+        self._edits = []
+
+    def insert_text(self, text, style=None, cursors=None):
+        for cursor in cursors or self.document.cursors:
+            self._edits.append(
+                (cursor.position, cursor.position, text, style or PLAIN))
+
+    def delete(self, count=1, cursors=None):
+        """Delete count characters after each cursor"""
+        length = len(self.document)
+        for cursor in cursors or self.document.cursors:
+            self._edits.append(
+                (cursor.position, min(cursor.position + count, length), '', None))
+
+    def backspace(self, count=1, cursors=None):
+        """Delete count characters before each cursor"""
+        for cursor in cursors or self.document.cursors:
+            self._edits.append(
+                (max(cursor.position - count, 0), cursor.position, '', None))
+
+    def edits(self):
+        """The queued edits sorted, with overlapping deletions merged"""
+        merged = []
+        for start, end, text, style in sorted(
+                self._edits, key=lambda edit: (edit[0], edit[1])):
+            if start == end and not text:
+                continue
+            if merged and start < merged[-1][1]:
+                last = merged[-1]
+                merged[-1] = (last[0], max(last[1], end), last[2] + text,
+                              last[3])
+            else:
+                merged.append((start, end, text, style))
+        return merged
 
 
 class Cursor:
@@ -33,21 +1108,23 @@ class Cursor:
     def back(self):
         self.position -= 1
 
+    @property
+    def line(self):
+        return self.document.line_of(self.position)
+
     def home(self):
-        while self.document.characters[self.position - 1].character != '\n':
-            self.position -= 1
-            if self.position == 0:
-                # Got to the begenning of the file before newline
-                break
+        self.position = self.document.lines.line_start(self.line)
 
     def end(self):
-        while (
-                self.position < len(self.document.characters)
-                and self.document.characters[self.position].character != '\n'
-            ):
-            self.position += 1
+        self.position = self.document.lines.line_end(self.line)
+
+    def goto_line(self, line):
+        """Move to the start of a zero based line, clamped to the document"""
+        self.position = self.document.lines.line_start(line)
 
 class Character:
+    __slots__ = ('character', 'bold', 'italic', 'underline')
+
     def __init__(self, character, bold=False, italic=False, underline=False):
         assert len(character) == 1
         self.character = character
@@ -55,6 +1132,10 @@ class Character:
         self.italic = italic
         self.underline = underline
 
+    @property
+    def style(self):
+        return (self.bold, self.italic, self.underline)
+
     def __str__(self):
         bold = '*' if self.bold else ''
         italic = '/' if self.italic else ''
@@ -63,6 +63,9 @@ class ScaleZip():
 
 
 # Ex.3, add error handling to the case study example
+from case_study import GapBuffer
+
+
 class DeleteError(Exception):
     pass
 
@@ -72,8 +75,8 @@ class SaveError(Exception):
 
 
 class Document:
-    def __init__(self):
-        self.characters = []
+    def __init__(self, storage=GapBuffer):
+        self.characters = storage()
         self.cursor = Cursor(self)
         self.filename = ''
 
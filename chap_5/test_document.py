@@ -0,0 +1,190 @@
+import importlib.util
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+
+def load_module(name, filename):
+    # chap_6 has a case_study module too, so import this one under its own name
+    spec = importlib.util.spec_from_file_location(
+        name, Path(__file__).with_name(filename))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+case_study = load_module('chap_5_case_study', 'case_study.py')
+Character = case_study.Character
+Document = case_study.Document
+GapBuffer = case_study.GapBuffer
+StyledText = case_study.StyledText
+
+STORAGES = [GapBuffer, StyledText]
+BOLD = (True, False, False)
+
+
+def rendered(model):
+    return ''.join(str(Character(c, *style)) for c, style in model)
+
+
+def random_text(rng):
+    return ''.join(rng.choice('ab\n') for _ in range(rng.randrange(1, 6)))
+
+
+def check_lines(document, text):
+    starts = [0] + [i + 1 for i, c in enumerate(text) if c == '\n']
+    lines = document.lines
+    assert len(lines) == len(starts)
+    for number, start in enumerate(starts):
+        assert lines.line_start(number) == start
+        end = starts[number + 1] - 1 if number + 1 < len(starts) else len(text)
+        assert lines.line_end(number) == end
+    for position in range(len(text) + 1):
+        assert lines.line_of(position) == text.count('\n', 0, position)
+
+
+@pytest.mark.parametrize('storage', STORAGES)
+def test_edits_match_a_list(storage):
+    rng = random.Random(1)
+    document = Document(storage)
+    model = []
+    for _ in range(400):
+        position = rng.randrange(len(model) + 1)
+        document.cursor.position = position
+        action = rng.randrange(5)
+        if action == 0:
+            character = rng.choice('xy\n')
+            document.insert(character)
+            model.insert(position, (character, (False,) * 3))
+        elif action == 1 and position < len(model):
+            document.delete()
+            del model[position]
+        elif action == 2:
+            text = random_text(rng)
+            document.insert_text(text, BOLD)
+            model[position:position] = [(c, BOLD) for c in text]
+        elif action == 3:
+            end = position + rng.randrange(8)
+            document.delete_range(position, end)
+            del model[position:end]
+        else:
+            end = position + rng.randrange(8)
+            document.restyle(position, end, BOLD)
+            model[position:end] = [(c, BOLD) for c, _ in model[position:end]]
+        assert len(document) == len(model)
+        assert document.string == rendered(model)
+    text = ''.join(c for c, _ in model)
+    assert document.text == text
+    check_lines(document, text)
+
+
+@pytest.mark.parametrize('storage', STORAGES)
+def test_home_end_and_goto_line(storage):
+    document = Document(storage)
+    document.insert_text('first\nsecond line\n\nlast')
+    cursor = document.cursor
+    cursor.goto_line(1)
+    assert (cursor.position, cursor.line) == (6, 1)
+    cursor.end()
+    assert cursor.position == 17
+    cursor.home()
+    assert cursor.position == 6
+    cursor.goto_line(2)
+    cursor.end()
+    assert cursor.position == 18
+    cursor.goto_line(99)
+    assert cursor.line == 3
+    cursor.end()
+    assert cursor.position == len(document)
+
+
+@pytest.mark.parametrize('storage', STORAGES)
+def test_render_cache_sees_formatting_changes(storage):
+    document = Document(storage)
+    document.render_cache.chunk_size = 4
+    document.insert_text('hello world')
+    assert document.string == 'hello world'
+    document.restyle(6, 8, BOLD)
+    assert document.string == 'hello *w*orld'
+    document.undo()
+    assert document.string == 'hello world'
+    if storage is GapBuffer:
+        # Characters handed out can be changed in place
+        document.characters[0].italic = True
+        assert document.string == '/hello world'
+
+
+@pytest.mark.parametrize('storage', STORAGES)
+def test_undo_redo_round_trip(storage):
+    rng = random.Random(2)
+    document = Document(storage)
+    document.journal.coalesce_timeout = 0
+    states = [document.string]
+    for _ in range(60):
+        position = rng.randrange(len(document) + 1)
+        document.cursor.position = position
+        if rng.randrange(3):
+            document.insert_text(random_text(rng), rng.choice([BOLD, None]))
+        else:
+            document.delete_range(position, position + rng.randrange(1, 6))
+        if document.string != states[-1]:
+            states.append(document.string)
+    for state in reversed(states[:-1]):
+        assert document.undo()
+        assert document.string == state
+    assert not document.undo()
+    for state in states[1:]:
+        assert document.redo()
+        assert document.string == state
+    assert not document.redo()
+
+
+@pytest.mark.parametrize('storage', STORAGES)
+def test_edit_batch_merges_overlapping_deletes(storage):
+    document = Document(storage)
+    document.insert_text('abcdefghij')
+    document.cursor.position = 2
+    document.add_cursor(3)
+    document.add_cursor(8)
+    with document.edit_batch() as batch:
+        batch.delete(2)
+        batch.insert_text('-')
+    assert document.text == 'ab--fgh-'
+    assert sorted(cursor.position for cursor in document.cursors) == [3, 4, 8]
+    assert document.undo()
+    assert document.text == 'abcdefghij'
+
+
+@pytest.mark.parametrize('storage', STORAGES)
+def test_insert_past_the_end(storage):
+    document = Document(storage)
+    document.insert_text('ab')
+    for _ in range(3):
+        document.cursor.forward()
+    document.insert('\n')
+    document.insert('x')
+    assert document.text == 'ab\nx'
+    assert document.cursor.position == 4
+    check_lines(document, 'ab\nx')
+
+
+@pytest.mark.parametrize('storage', STORAGES)
+def test_load_edit_save(storage, tmp_path):
+    path = tmp_path / 'text.txt'
+    original = 'one\ntwo\nthree\n' * 50
+    path.write_text(original)
+    document = Document.load(path, storage)
+    document.cursor.goto_line(1)
+    assert document.cursor.position == 4
+    document.delete_range(0, 4)
+    document.cursor.position = 0
+    document.insert_text('zero\n')
+    document.filename = str(tmp_path / 'saved.txt')
+    document.save()
+    expected = 'zero\n' + original[4:]
+    assert (tmp_path / 'saved.txt').read_text() == expected
+    check_lines(document, expected)
+    assert path.read_text() == original
@@ -0,0 +1,107 @@
+import io
+import os
+import zipfile
+from functools import partial
+
+from zipsearch import (ResultCache, ZipReplace, compile_alternation,
+                       process_archives, replace_stream)
+
+
+def make_zip(path, members):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+
+
+class Unseekable(io.RawIOBase):
+    """A write-only file zipfile cannot seek back in"""
+    def __init__(self, file):
+        self.file = file
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.file.write(data)
+
+
+def make_mixed_zip(path):
+    """One stored, one deflated and one data descriptor member"""
+    with open(path, 'wb') as file:
+        with zipfile.ZipFile(Unseekable(file), 'w') as archive:
+            archive.writestr('stored.txt', b'stored ' * 100)
+            archive.writestr('deflated.txt', b'deflated ' * 100,
+                             zipfile.ZIP_DEFLATED)
+            with archive.open('described.txt', 'w') as member:
+                member.write(b'described ' * 100)
+    with zipfile.ZipFile(path) as archive:
+        assert archive.getinfo('described.txt').flag_bits & 0x08
+        return {info.filename: archive.read(info) for info in archive.infolist()}
+
+
+def read_zip(path):
+    with zipfile.ZipFile(path) as archive:
+        assert archive.testzip() is None
+        return {info.filename: archive.read(info) for info in archive.infolist()}
+
+
+def test_matches_across_chunk_boundaries():
+    # With 5-character chunks every offset of "abcd" lands on a boundary
+    text = ''.join('x' * offset + 'abcd' + 'ab' for offset in range(12))
+    expected = text.replace('abcd', '-').replace('ab', '-')
+    for source, target, keys, repl, result in (
+            (io.StringIO(text), io.StringIO(), ('abcd', 'ab'), '-', expected),
+            (io.BytesIO(text.encode()), io.BytesIO(), (b'abcd', b'ab'), b'-',
+             expected.encode())):
+        pattern = compile_alternation(keys)
+        assert replace_stream(source, target, pattern, repl, 4, chunk_size=5) == 24
+        assert target.getvalue() == result
+
+
+def test_long_search_string(tmp_path):
+    key = 'L' * 1500
+    path = tmp_path / 'long.zip'
+    make_zip(path, {'a.txt': 'x' + key + 'y' + key[:-1]})
+    ZipReplace(str(path), key, 'z', chunk_size=1000).process_zip(streaming=True)
+    assert read_zip(path) == {'a.txt': b'xzy' + key[:-1].encode()}
+
+
+def test_keys_nested_in_each_other():
+    # Every key is a prefix of the next, too deep to nest as trie groups
+    keys = tuple('a' * length for length in range(1, 1200))
+    pattern = compile_alternation(keys)
+    assert pattern.match('a' * 2000).end() == 1199
+    assert pattern.fullmatch('a' * 7)
+
+
+def test_copy_raw(tmp_path):
+    path = tmp_path / 'mixed.zip'
+    members = make_mixed_zip(path)
+    processor = ZipReplace(str(path), 'nowhere', 'x')
+    processor.process_zip(streaming=True)
+    assert processor.stats.raw_copies == 3
+    assert read_zip(path) == members
+
+
+def test_cached_members(tmp_path):
+    path = tmp_path / 'mixed.zip'
+    members = make_mixed_zip(path)
+    cache = ResultCache(tmp_path / 'cache')
+    ZipReplace(str(path), 'stored', 'kept', cache=cache).process_zip(streaming=True)
+    make_mixed_zip(path)
+    processor = ZipReplace(str(path), 'stored', 'kept', cache=cache)
+    processor.process_zip(streaming=True)
+    assert processor.stats.cache_hits == 3
+    members['stored.txt'] = b'kept ' * 100
+    assert read_zip(path) == members
+
+
+def test_archive_named_twice(tmp_path):
+    path = tmp_path / 'x.zip'
+    make_zip(path, {'a.txt': 'foo'})
+    other = os.path.join(tmp_path, '.', 'x.zip')
+    stats = process_archives(partial(ZipReplace, search_string='foo',
+                                     replace_string='foofoo'),
+                             [str(path), str(path), other], jobs=2)
+    assert (stats.archives, stats.failed) == (1, 0)
+    assert read_zip(path) == {'a.txt': b'foofoo'}
@@ -1,10 +1,143 @@
 # Manager Objects
 
+import argparse
+import copy
+import glob
+import hashlib
+import io
+import os
+import re
 import shutil
+import queue
+import struct
 import sys
+import tempfile
+import time
 import zipfile
+from collections import deque
+from concurrent.futures import (FIRST_COMPLETED, Future, ProcessPoolExecutor,
+                                wait)
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache, partial
+from multiprocessing import Manager
 from pathlib import Path
 
+# Characters (or bytes) read from a member per step when streaming
+CHUNK_SIZE = 1 << 20
+# Processed output held in memory before stream_member spills it to disk
+SPOOL_SIZE = 16 << 20
+# Deepest nesting of groups trie_regex output may have before
+# compile_alternation falls back to a flat alternation
+MAX_GROUP_DEPTH = 100
+# Seconds between progress reports from an archive being processed
+PROGRESS_INTERVAL = 0.25
+
+
+def replace_stream(source, target, pattern, repl, longest, chunk_size=CHUNK_SIZE):
+    """Copy source to target, replacing pattern matches, in fixed-size chunks.
+
+    Works on text or binary file objects. pattern never matches more than
+    longest characters, so the last longest - 1 characters of each chunk
+    are carried over into the next one and a match straddling a chunk
+    boundary is still found. repl is a string, or a function of the match.
+    Returns the number of replacements made.
+    """
+    count = 0
+    carry = None
+    while True:
+        chunk = source.read(chunk_size)
+        buffer = chunk if carry is None else carry + chunk
+        final = not chunk
+        # No match starting before cut can run past the end of the buffer
+        cut = len(buffer) if final else len(buffer) - longest + 1
+        parts = []
+        position = 0
+        for match in pattern.finditer(buffer):
+            if match.start() >= cut:
+                break
+            parts.append(buffer[position:match.start()])
+            parts.append(repl(match) if callable(repl) else repl)
+            position = match.end()
+            count += 1
+        keep = max(position, cut)
+        parts.append(buffer[position:keep])
+        target.write(buffer[:0].join(parts))
+        carry = buffer[keep:]
+        if final:
+            return count
+
+
+@lru_cache(maxsize=32)
+def compile_alternation(keys):
+    """One regex matching any of keys, compiled once and reused per member.
+
+    The keys are folded into a trie first, so the regex shares common
+    prefixes. At each position it walks at most one path down the trie
+    instead of trying every key in turn, which keeps the scan linear in
+    the input however many keys there are.
+    """
+    binary = isinstance(keys[0], bytes)
+    if binary:
+        # One character per byte, so the escaped regex encodes back 1:1
+        keys = [key.decode('latin-1') for key in keys]
+    trie = {}
+    for key in keys:
+        node = trie
+        for character in key:
+            node = node.setdefault(character, {})
+        node[''] = True
+    regex, depth = trie_regex(trie)
+    if depth > MAX_GROUP_DEPTH:
+        # re's parser recurses into nested groups, keys that are prefixes
+        # of many others would nest too deep; longest first still makes the
+        # longest key win at each position
+        regex = '|'.join(re.escape(key)
+                         for key in sorted(set(keys), key=len, reverse=True))
+    return re.compile(regex.encode('latin-1') if binary else regex)
+
+
+def trie_regex(trie):
+    """Regex for a trie, trying longer keys before shorter ones.
+
+    Returns the regex and how deeply its groups nest. The trie is walked
+    with an explicit stack rather than recursion, so keys can be any length.
+    """
+    parts = []
+    depth = deepest = 0
+    # What is left to write, popped from the end: regex text, trie nodes to
+    # expand and changes to the group depth
+    stack = [trie]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            parts.append(item)
+            continue
+        if isinstance(item, int):
+            depth += item
+            continue
+        branches = [(character, child)
+                    for character, child in sorted(item.items()) if character]
+        if not branches:
+            continue
+        closing = []
+        if '' in item:
+            parts.append('(?:')
+            closing.insert(0, ')?')
+        if len(branches) > 1:
+            parts.append('(?:')
+            closing.insert(0, ')')
+        depth += len(closing)
+        deepest = max(deepest, depth)
+        following = []
+        for number, (character, child) in enumerate(branches):
+            if number:
+                following.append('|')
+            following += [re.escape(character), child]
+        following += [-len(closing)] + closing
+        stack.extend(reversed(following))
+    return ''.join(parts), deepest
+
+
 class ZipReplace:
     """First verstion of this for replacing strings only"""
     def __init__(self, filename, search_string, replace_string):
@@ -38,20 +171,530 @@ class ZipReplace:
         shutil.rmtree(self.temp_directory)
 
 
+class ZipStats:
+    """Throughput counters for archives run through ZipProcessor.stream_zip.
+
+    Times are in seconds. process is CPU time summed over pool workers when
+    members are processed in parallel.
+    """
+    def __init__(self):
+        self.archives = 0
+        self.failed = 0
+        self.members = 0
+        self.raw_copies = 0
+        self.cache_hits = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.decompress = 0.0
+        self.process = 0.0
+        self.compress = 0.0
+        self.copy = 0.0
+        self.elapsed = 0.0
+
+    def __iadd__(self, other):
+        for name, value in vars(other).items():
+            setattr(self, name, getattr(self, name) + value)
+        return self
+
+    def report(self):
+        elapsed = self.elapsed or 1e-9
+        busy = (self.decompress + self.process + self.compress + self.copy) or 1e-9
+        megabytes = 1 << 20
+        split = ', '.join(
+            f'{name} {seconds:.2f}s ({seconds / busy:.0%})'
+            for name, seconds in [('decompress', self.decompress),
+                                  ('process', self.process),
+                                  ('compress', self.compress),
+                                  ('raw copy', self.copy)])
+        return '\n'.join([
+            f'{self.archives} archives ({self.failed} failed), '
+            f'{self.members} members '
+            f'({self.raw_copies} copied raw, {self.cache_hits} from cache) '
+            f'in {elapsed:.2f}s',
+            f'{self.members / elapsed:.1f} members/sec, '
+            f'{self.bytes_in / megabytes / elapsed:.1f} MB/sec in, '
+            f'{self.bytes_out / megabytes / elapsed:.1f} MB/sec out',
+            split,
+        ])
+
+
+class TimedFile(io.BufferedIOBase):
+    """Wraps a member file, adding time spent reading or writing it to stats"""
+    def __init__(self, file, stats, field):
+        self.file = file
+        self.stats = stats
+        self.field = field
+
+    def readable(self):
+        return self.file.readable()
+
+    def writable(self):
+        return self.file.writable()
+
+    def read(self, size=-1):
+        return self._timed(self.file.read, size)
+
+    def read1(self, size=-1):
+        return self._timed(self.file.read1, size)
+
+    def write(self, data):
+        return self._timed(self.file.write, data)
+
+    def _timed(self, method, argument):
+        start = time.perf_counter()
+        try:
+            return method(argument)
+        finally:
+            setattr(self.stats, self.field, getattr(self.stats, self.field)
+                    + time.perf_counter() - start)
+
+
+class HashingFile(io.BufferedIOBase):
+    """Wraps a file being read, feeding everything read from it to digest"""
+    def __init__(self, file, digest):
+        self.file = file
+        self.digest = digest
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.digest.update(data)
+        return data
+
+    def read1(self, size=-1):
+        data = self.file.read1(size)
+        self.digest.update(data)
+        return data
+
+
+class ResultCache:
+    """Processed members on disk, keyed by a hash of the member's content and
+    of the processor settings that produced them.
+
+    Each entry is one file, a marker byte followed by the processed member
+    (nothing after the marker when processing left it unchanged). Reading an
+    entry marks it recently used; once the directory holds more than
+    max_bytes the least recently used entries are deleted.
+
+    Each member also gets an alias entry keyed by its CRC, so a member seen
+    before is found with one pass to check its hash rather than hashing
+    every member ahead of processing it.
+    """
+    CHANGED = b'+'
+    UNCHANGED = b'='
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        # Worked out on the first write, the directory may be shared
+        self.size = None
+
+    def key(self, settings, source, chunk_size=CHUNK_SIZE):
+        """The key for a member given as bytes or as a file to read"""
+        digest = self.digest(settings)
+        if isinstance(source, bytes):
+            digest.update(source)
+        else:
+            for chunk in iter(lambda: source.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def digest(self, settings):
+        """A hash to feed a member through, hexdigest() is then its key"""
+        return hashlib.sha256(settings)
+
+    def alias(self, settings, info):
+        """A key found from a member's CRC and size, without decompressing it.
+
+        CRCs can collide, so the entry under it only holds the member's real
+        key, to be checked against the content before use.
+        """
+        return hashlib.sha256(b'crc\0%s%d:%d' % (settings, info.CRC,
+                                                info.file_size)).hexdigest()
+
+    def path(self, key):
+        return self.directory / key[:2] / key
+
+    def open(self, key):
+        """Return (unchanged, file) with file just past the marker, or None"""
+        path = self.path(key)
+        try:
+            file = path.open('rb')
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return file.read(1) == self.UNCHANGED, file
+
+    def get(self, key):
+        """The processed bytes, None if unchanged, or a miss if not cached"""
+        entry = self.open(key)
+        if entry is None:
+            return self.miss
+        unchanged, file = entry
+        with file:
+            return None if unchanged else file.read()
+
+    # Sentinel for get, None already means unchanged
+    miss = object()
+
+    def put(self, key, data):
+        """Store processed bytes, or None for a member left unchanged"""
+        with self.writer(key, unchanged=data is None) as file:
+            if data is not None:
+                file.write(data)
+
+    @contextmanager
+    def writer(self, key, unchanged=False):
+        """A file to write an entry to, kept only if the block succeeds"""
+        path = self.path(key)
+        path.parent.mkdir(exist_ok=True)
+        fd, temp_name = tempfile.mkstemp(suffix='.tmp', dir=path.parent)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(self.UNCHANGED if unchanged else self.CHANGED)
+                yield file
+            os.replace(temp_name, path)
+        except BaseException:
+            os.unlink(temp_name)
+            raise
+        self.added(path)
+
+    def added(self, path):
+        if self.size is None:
+            self.size = sum(size for size, _, _ in self.entries())
+        else:
+            self.size += path.stat().st_size
+        if self.size > self.max_bytes:
+            self.trim()
+
+    def entries(self):
+        entries = []
+        for path in self.directory.glob('??/*'):
+            if path.suffix == '.tmp':
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_size, stat.st_mtime, path))
+        return entries
+
+    def trim(self):
+        """Delete the least recently used entries, down to 3/4 of max_bytes"""
+        entries = sorted(self.entries(), key=lambda entry: entry[1])
+        self.size = sum(size for size, _, _ in entries)
+        for size, _, path in entries:
+            if self.size <= self.max_bytes * 3 // 4:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+
 class ZipProcessor:
-    """Modified version to allow inheritence and modularization, abstraction"""
-    def __init__(self, zipname):
+    """Modified version to allow inheritence and modularization, abstraction
+
+    Give stream_zip a ResultCache as cache to skip members it has seen before.
+    """
+    # Members bigger than this are streamed in the main process rather than
+    # read whole and sent to a pool worker
+    parallel_limit = 64 << 20
+    # Uncompressed bytes held for members in flight to the pool, at most
+    window_bytes = 256 << 20
+
+    def __init__(self, zipname, cache=None):
         self.zipname = zipname
         self.temp_directory = Path(f'unzipped-{zipname[:-4]}')
+        self.stats = ZipStats()
+        self.cache = cache
+        # A queue to put (members, bytes) done on every so often, if any
+        self.progress = None
+        self._reported = (0, 0)
+        self._reported_at = time.monotonic()
+
+    def settings(self):
+        """Everything besides the member that affects the processed output"""
+        raise NotImplementedError
+
+    def cache_settings(self):
+        return repr((type(self).__qualname__, self.settings())).encode()
 
-    def process_zip(self):
+    def process_zip(self, streaming=False, workers=1, window=None):
+        if streaming or workers > 1:
+            self.stream_zip(workers, window)
+            return
         self.unzip_files()
         self.process_files()
         self.zip_files()
 
+    def stream_zip(self, workers=1, window=None):
+        """Process every member straight from the archive into a new one.
+
+        Nothing is extracted to disk: each member is read from the old
+        archive, handed to process_stream and written to a temporary archive
+        next to it, which then replaces the original in one rename.
+
+        With more than one worker, members are fanned out to a process pool
+        through process_member and written back in their original order. At
+        most window members (four per worker by default), and window_bytes of
+        them, are held in memory at once. Members over parallel_limit are
+        streamed in this process instead.
+        """
+        start = time.perf_counter()
+        directory = os.path.dirname(os.path.abspath(self.zipname))
+        fd, temp_name = tempfile.mkstemp(suffix='.zip', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as temp_file, \
+                    zipfile.ZipFile(self.zipname) as source, \
+                    zipfile.ZipFile(temp_file, 'w') as target:
+                target.comment = source.comment
+                if workers > 1:
+                    self.stream_parallel(source, target, workers,
+                                         window or workers * 4)
+                else:
+                    for info in source.infolist():
+                        self.stream_member(source, target, info)
+                        self.report_progress()
+            shutil.copymode(self.zipname, temp_name)
+            os.replace(temp_name, self.zipname)
+        except BaseException:
+            os.unlink(temp_name)
+            raise
+        finally:
+            self.report_progress(final=True)
+        self.stats.archives += 1
+        self.stats.elapsed += time.perf_counter() - start
+
+    def stream_parallel(self, source, target, workers, window):
+        in_flight = deque()
+        held = 0
+        with ProcessPoolExecutor(workers, initializer=start_worker,
+                                 initargs=(self,)) as pool:
+            for info in source.infolist():
+                if info.file_size > self.parallel_limit:
+                    # Keep the member order, then stream it in constant memory
+                    while in_flight:
+                        self.write_result(source, target, *in_flight.popleft())
+                    held = 0
+                    self.stream_member(source, target, info)
+                    self.report_progress()
+                    continue
+                while in_flight and (len(in_flight) >= window
+                                     or held + info.file_size > self.window_bytes):
+                    held -= in_flight[0][0].file_size
+                    self.write_result(source, target, *in_flight.popleft())
+                key = result = None
+                if not info.is_dir():
+                    start = time.perf_counter()
+                    data = source.read(info)
+                    self.stats.decompress += time.perf_counter() - start
+                    if self.cache:
+                        key = self.cache.key(self.cache_settings(), data)
+                        result = self.cached_result(key)
+                    if result:
+                        key = None
+                    else:
+                        result = pool.submit(process_in_worker, info.filename,
+                                             data)
+                in_flight.append((info, key, result))
+                held += info.file_size
+            while in_flight:
+                self.write_result(source, target, *in_flight.popleft())
+
+    def cached_result(self, key):
+        """A finished Future like process_in_worker's, or None on a miss"""
+        data = self.cache.get(key)
+        if data is self.cache.miss:
+            return None
+        self.stats.cache_hits += 1
+        result = Future()
+        result.set_result((data, 0.0))
+        return result
+
+    def write_result(self, source, target, info, key, result):
+        if result is None:
+            target.writestr(self.copy_info(info), b'')
+            return
+        data, seconds = result.result()
+        if key:
+            self.cache.put(key, data)
+            self.cache.put(self.cache.alias(self.cache_settings(), info),
+                           key.encode())
+        self.stats.members += 1
+        self.stats.bytes_in += info.file_size
+        self.stats.process += seconds
+        start = time.perf_counter()
+        if data is None:
+            self.copy_raw(source, target, info)
+            self.stats.copy += time.perf_counter() - start
+        else:
+            target.writestr(self.copy_info(info), data)
+            self.stats.compress += time.perf_counter() - start
+            self.stats.bytes_out += len(data)
+        self.report_progress()
+
+    def report_progress(self, final=False):
+        """Put the members and bytes done since the last report on progress"""
+        if self.progress is None:
+            return
+        now = time.monotonic()
+        if not final and now - self._reported_at < PROGRESS_INTERVAL:
+            return
+        members, bytes_in = self.stats.members, self.stats.bytes_in
+        self.progress.put((members - self._reported[0],
+                           bytes_in - self._reported[1]))
+        self._reported = (members, bytes_in)
+        self._reported_at = now
+
+    def copy_info(self, info):
+        """A fresh ZipInfo with the name, date and settings of info"""
+        new_info = zipfile.ZipInfo(info.filename, info.date_time)
+        new_info.compress_type = info.compress_type
+        new_info.external_attr = info.external_attr
+        new_info.comment = info.comment
+        return new_info
+
+    def copy_raw(self, source, target, info):
+        """Copy a member's compressed bytes across without recompressing.
+
+        zipfile has no public API for this, so the local header is written
+        by hand the same way ZipFile.write does it.
+        """
+        new_info = copy.copy(info)
+        # Sizes and CRC are known, so they go in the header, not a descriptor
+        new_info.flag_bits &= ~0x08
+        new_info.extra = zipfile._strip_extra(info.extra, (1,))
+        with source._lock, target._lock:
+            source.fp.seek(info.header_offset)
+            header = source.fp.read(zipfile.sizeFileHeader)
+            name_length, extra_length = struct.unpack('<HH', header[26:30])
+            source.fp.seek(info.header_offset + zipfile.sizeFileHeader
+                           + name_length + extra_length)
+            target.fp.seek(target.start_dir)
+            new_info.header_offset = target.fp.tell()
+            target.fp.write(new_info.FileHeader(
+                info.file_size > zipfile.ZIP64_LIMIT
+                or info.compress_size > zipfile.ZIP64_LIMIT))
+            remaining = info.compress_size
+            while remaining:
+                chunk = source.fp.read(min(remaining, CHUNK_SIZE))
+                if not chunk:
+                    raise zipfile.BadZipFile(f'{info.filename} is truncated')
+                target.fp.write(chunk)
+                remaining -= len(chunk)
+            target.filelist.append(new_info)
+            target.NameToInfo[new_info.filename] = new_info
+            target.start_dir = target.fp.tell()
+            target._didModify = True
+        self.stats.raw_copies += 1
+        self.stats.bytes_out += info.file_size
+
+    def stream_member(self, source, target, info):
+        new_info = self.copy_info(info)
+        if info.is_dir():
+            target.writestr(new_info, b'')
+            return
+        stats = self.stats
+        stats.members += 1
+        stats.bytes_in += info.file_size
+        digest = alias = None
+        if self.cache and not info.flag_bits & 0x01:
+            alias = self.cache.alias(self.cache_settings(), info)
+            if self.stream_cached(source, target, info, alias):
+                return
+            digest = self.cache.digest(self.cache_settings())
+        start = time.perf_counter()
+        waiting = stats.decompress + stats.compress
+        # The output waits here until it is known whether anything changed,
+        # the member is only decompressed and processed once either way
+        with source.open(info) as source_file, \
+                tempfile.SpooledTemporaryFile(SPOOL_SIZE) as output:
+            reader = TimedFile(source_file, stats, 'decompress')
+            if digest:
+                reader = HashingFile(reader, digest)
+            changes = self.process_stream(info.filename, reader, output)
+            if digest:
+                # The key covers the whole member, read or not
+                for _ in iter(lambda: reader.read(CHUNK_SIZE), b''):
+                    pass
+            stats.process += (time.perf_counter() - start
+                              - (stats.decompress + stats.compress - waiting))
+            key = digest.hexdigest() if digest else None
+            start = time.perf_counter()
+            if not changes:
+                self.copy_raw(source, target, info)
+                stats.copy += time.perf_counter() - start
+                if key:
+                    self.cache.put(key, None)
+                    self.cache.put(alias, key.encode())
+                return
+            size = output.tell()
+            output.seek(0)
+            with (self.cache.writer(key) if key else nullcontext()) as entry, \
+                    target.open(new_info, 'w',
+                                force_zip64=size > 1 << 30) as target_file:
+                for chunk in iter(lambda: output.read(CHUNK_SIZE), b''):
+                    target_file.write(chunk)
+                    if entry:
+                        entry.write(chunk)
+            stats.compress += time.perf_counter() - start
+        if key:
+            self.cache.put(alias, key.encode())
+        stats.bytes_out += new_info.file_size
+
+    def stream_cached(self, source, target, info, alias):
+        """Write the member out of the cache, if it is there"""
+        key = self.cache.get(alias)
+        if key is self.cache.miss or key is None:
+            return False
+        # The alias only goes by the CRC, make sure it is the same content
+        with source.open(info) as source_file:
+            if self.cache.key(self.cache_settings(),
+                              TimedFile(source_file, self.stats,
+                                        'decompress')) != key.decode():
+                return False
+        entry = self.cache.open(key.decode())
+        if entry is None:
+            return False
+        unchanged, file = entry
+        stats = self.stats
+        stats.cache_hits += 1
+        start = time.perf_counter()
+        with file:
+            if unchanged:
+                self.copy_raw(source, target, info)
+                stats.copy += time.perf_counter() - start
+                return True
+            new_info = self.copy_info(info)
+            size = os.fstat(file.fileno()).st_size
+            with target.open(new_info, 'w', force_zip64=size > 1 << 30) as target_file:
+                shutil.copyfileobj(file, target_file, CHUNK_SIZE)
+        stats.compress += time.perf_counter() - start
+        stats.bytes_out += new_info.file_size
+        return True
+
+    def process_stream(self, name, source, target):
+        """Copy one member from source to target, processing it on the way.
+
+        Returns how many changes were made; members with none are copied raw.
+        """
+        data = source.read()
+        processed = self.process_member(name, data)
+        target.write(processed)
+        return int(processed != data)
+
+    def process_member(self, name, data):
+        """Return the processed bytes of one member, used by stream_zip"""
+        raise NotImplementedError
+
     def unzip_files(self):
         self.temp_directory.mkdir()
-        with zipfile.ZipFile(self.filename) as zip:
+        with zipfile.ZipFile(self.zipname) as zip:
             zip.extractall(self.temp_directory)
 
     def zip_files(self):
@@ -61,32 +704,252 @@ class ZipProcessor:
         shutil.rmtree(self.temp_directory)
 
 
+# The processor a pool worker runs members through, set once per process
+worker_processor = None
+
+
+def start_worker(processor):
+    global worker_processor
+    worker_processor = processor
+
+
+def process_in_worker(name, data):
+    """Process one member, returning the result and the seconds it took.
+
+    The result is None when the member came out unchanged.
+    """
+    start = time.process_time()
+    processed = worker_processor.process_member(name, data)
+    seconds = time.process_time() - start
+    return (None if processed == data else processed), seconds
+
+
 class ZipReplace(ZipProcessor):
-    def __init__(self, filename, search_string, replace_string):
-        super().__init__(filename)
-        self.search_string = search_string
-        self.replace_string = replace_string
+    """Replace strings in every member.
+
+    Either one search_string and replace_string, or a dict mapping each
+    search string to its replacement. All of them are applied in a single
+    pass; where two overlap the leftmost, then longest, wins.
+    """
+    def __init__(self, filename, search_string, replace_string=None,
+                 encoding='utf-8', binary=False, chunk_size=CHUNK_SIZE,
+                 cache=None):
+        super().__init__(filename, cache)
+        if isinstance(search_string, dict):
+            self.replacements = dict(search_string)
+        else:
+            self.replacements = {search_string: replace_string}
+        if not self.replacements or not all(self.replacements):
+            raise ValueError('search strings must not be empty')
+        self.encoding = encoding
+        # Replace raw bytes rather than decoded text, members need not be text
+        self.binary = binary
+        self.chunk_size = chunk_size
+
+    def settings(self):
+        return tuple(self.replacements.items()), self.encoding, self.binary
 
     def process_files(self):
         """Perform a search and replace on all files in the temp directory"""
+        pattern, replace, _ = self.matcher(binary=False)
         for filename in self.temp_directory.iterdir():
             with filename.open() as file:
                 contents = file.read()
-            contents = contents.replace(self.search_string, self.replace_string)
+            contents = pattern.sub(replace, contents)
             with filename.open('w') as file:
                 file.write(contents)
 
+    def matcher(self, binary):
+        """The compiled pattern, replacement function and longest match"""
+        replacements = self.replacements
+        if binary:
+            replacements = {
+                key.encode(self.encoding) if isinstance(key, str) else key:
+                value.encode(self.encoding) if isinstance(value, str) else value
+                for key, value in replacements.items()
+            }
+        pattern = compile_alternation(tuple(replacements))
+        longest = max(len(key) for key in replacements)
+        return pattern, lambda match: replacements[match.group()], longest
+
+    def process_stream(self, name, source, target):
+        """Replace in constant memory, however big the member is"""
+        if self.binary:
+            return replace_stream(source, target, *self.matcher(binary=True),
+                                  self.chunk_size)
+        # surrogateescape lets bytes that are not valid text pass through
+        text_source = io.TextIOWrapper(source, self.encoding, 'surrogateescape',
+                                       newline='')
+        text_target = io.TextIOWrapper(target, self.encoding, 'surrogateescape',
+                                       newline='', write_through=True)
+        try:
+            return replace_stream(text_source, text_target,
+                                  *self.matcher(binary=False), self.chunk_size)
+        finally:
+            text_target.flush()
+            # Leave closing the member files to the caller
+            text_source.detach()
+            text_target.detach()
 
+    def process_member(self, name, data):
+        output = io.BytesIO()
+        self.process_stream(name, io.BytesIO(data), output)
+        return output.getvalue()
+
+
+import PIL
 from PIL import Image
 
 class ScaleZip(ZipProcessor):
+    """Scale every image in the archive to size.
+
+    resample is any Pillow resampling filter, Pillow's default if None.
+    process_zip runs a process pool, one worker per CPU unless told
+    otherwise, since resizing is CPU bound.
+    """
+    def __init__(self, zipname, size=(640, 480), resample=None, reducing_gap=3.0,
+                 cache=None):
+        super().__init__(zipname, cache)
+        self.size = tuple(size)
+        self.resample = resample
+        # Shrink with the cheap Image.reduce first when scaling down this much
+        self.reducing_gap = reducing_gap
+
+    def process_zip(self, streaming=True, workers=None, window=None):
+        super().process_zip(streaming, workers or os.cpu_count() or 1, window)
+
+    def settings(self):
+        # Another Pillow may well encode the same image differently
+        return self.size, self.resample, self.reducing_gap, PIL.__version__
+
     def process_files(self):
-        """Scale each image in the directory to 640x480"""
-        for filename in temp_directory.iterdir():
+        """Scale each image in the directory to self.size"""
+        for filename in self.temp_directory.iterdir():
             im = Image.open(str(filename))
-            scaled = im.resize((640, 480))
+            scaled = im.resize(self.size, self.resample)
             scaled.save(filename)
 
+    def process_member(self, name, data):
+        try:
+            im = Image.open(io.BytesIO(data))
+        except Image.UnidentifiedImageError:
+            # Not an image, leave it as it is
+            return data
+        image_format = im.format
+        # JPEGs can be decoded straight at 1/2, 1/4 or 1/8 scale, as long as
+        # that is still at least the target size; other formats ignore it
+        im.draft(im.mode, self.size)
+        scaled = im.resize(self.size, self.resample,
+                           reducing_gap=self.reducing_gap)
+        output = io.BytesIO()
+        scaled.save(output, format=image_format)
+        return output.getvalue()
+
+def find_archives(patterns):
+    """Archives named by globs, or found under directories, in order"""
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            yield from sorted(str(path) for path in Path(pattern).rglob('*.zip'))
+        else:
+            yield from sorted(glob.glob(pattern, recursive=True))
+
+
+def run_archive(make_processor, zipname, progress=None):
+    processor = make_processor(zipname)
+    processor.progress = progress
+    processor.stream_zip()
+    return processor.stats
+
+
+def process_archives(make_processor, archives, jobs=None):
+    """Run make_processor(zipname).stream_zip() over many archives.
+
+    At most jobs archives are processed at once, in a process pool. A
+    progress line, updated as members finish, is kept up to date and the
+    combined ZipStats returned.
+    Archives named more than once, through any path, are processed once.
+    """
+    stats = ZipStats()
+    start = time.perf_counter()
+    # Two workers rewriting the same archive at once would clobber each other
+    unique = {}
+    for zipname in archives:
+        unique.setdefault(os.path.realpath(zipname), zipname)
+    members = bytes_in = 0
+    with Manager() as manager, ProcessPoolExecutor(jobs) as pool:
+        # Workers report members as they go, so one big archive still
+        # shows progress while it runs
+        progress = manager.Queue()
+        futures = {pool.submit(run_archive, make_processor, zipname, progress):
+                   zipname for zipname in unique.values()}
+        pending = set(futures)
+        while pending:
+            finished, pending = wait(pending, PROGRESS_INTERVAL * 2,
+                                     FIRST_COMPLETED)
+            for future in finished:
+                try:
+                    stats += future.result()
+                except Exception as error:
+                    stats.failed += 1
+                    print(f'\n{futures[future]}: {error}', file=sys.stderr)
+            while True:
+                try:
+                    done_members, done_bytes = progress.get_nowait()
+                except queue.Empty:
+                    break
+                members += done_members
+                bytes_in += done_bytes
+            elapsed = time.perf_counter() - start
+            print(f'\r[{len(futures) - len(pending)}/{len(futures)}] '
+                  f'{members} members, '
+                  f'{bytes_in / (1 << 20) / elapsed:.1f} MB/sec, '
+                  f'{stats.failed} failed, {elapsed:.0f}s', end='', flush=True)
+    print()
+    # Summed per-archive times overlap, the report wants wall-clock time
+    stats.elapsed = time.perf_counter() - start
+    return stats
+
+
 if __name__ == "__main__":
-    ScaleZip(*sys.argv[1:4]).process_zip()
+    parser = argparse.ArgumentParser(
+        description='Process zip archives in place, many at a time')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='archives processed at once (default: CPU count)')
+    parser.add_argument('--cache', metavar='DIRECTORY',
+                        help='reuse results for members processed before')
+    parser.add_argument('--cache-mb', type=int, default=1024,
+                        help='size the cache is trimmed to (default: 1024)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    replace = commands.add_parser('replace', help='search and replace text')
+    replace.add_argument('search')
+    replace.add_argument('replace')
+    replace.add_argument('--binary', action='store_true')
+    scale = commands.add_parser('scale', help='scale images')
+    scale.add_argument('--size', default='640x480', help='WIDTHxHEIGHT')
+    for command in (replace, scale):
+        command.add_argument('archives', nargs='+',
+                             help='zip files, globs or directories of zip files')
+    args = parser.parse_args()
 
+    cache = None
+    if args.cache:
+        cache = ResultCache(args.cache, args.cache_mb << 20)
+    if args.command == 'replace':
+        make_processor = partial(ZipReplace, search_string=args.search,
+                                 replace_string=args.replace, binary=args.binary,
+                                 cache=cache)
+    else:
+        size = tuple(int(n) for n in args.size.lower().split('x'))
+        make_processor = partial(ScaleZip, size=size, cache=cache)
+    archives = []
+    missing = 0
+    for pattern in args.archives:
+        found = list(find_archives([pattern]))
+        if not found:
+            missing += 1
+            print(f'{pattern}: no zip files found', file=sys.stderr)
+        archives += found
+    stats = process_archives(make_processor, archives, args.jobs)
+    print(stats.report())
+    if stats.failed or missing:
+        sys.exit(1)
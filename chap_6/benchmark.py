@@ -0,0 +1,129 @@
+"""Crawl benchmarks for LinkCollector against the local fixture server.
+
+The fixture site is served from this process, and each crawl mode runs in a
+fresh process so the peak RSS reported is that crawl's own. Typical use,
+from this directory:
+
+    python benchmark.py --pages 5000 --latency 0.01 --modes serial,concurrent
+"""
+import argparse
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+from case_study import (CrawlStore, LinkCollector, ScalableBloomFilter,
+                        canonical_url)
+from fixture_server import add_site_arguments, serve, site_from_arguments
+
+
+class TimedCollector(LinkCollector):
+    """Records how long each page took, from the request to its last link"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+
+    def fetch_links(self, url):
+        start = time.perf_counter()
+        try:
+            yield from super().fetch_links(url)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+
+def serial(url, directory, concurrency):
+    collector = TimedCollector(url)
+    collector.crawl(concurrency=1, per_host=1)
+    return collector
+
+
+def concurrent(url, directory, concurrency):
+    collector = TimedCollector(url)
+    collector.crawl(concurrency=concurrency, per_host=concurrency)
+    return collector
+
+
+def store(url, directory, concurrency):
+    path = os.path.join(directory, f'crawl-{time.monotonic_ns()}.db')
+    crawl_store = CrawlStore(path)
+    collector = TimedCollector(url, store=crawl_store)
+    collector.crawl(concurrency=concurrency, per_host=concurrency)
+    # Failures are read out of the store, which is about to close
+    collector.failed_links = dict(crawl_store.failed.items())
+    crawl_store.close()
+    return collector
+
+
+def bloom(url, directory, concurrency):
+    collector = TimedCollector(url, visited=ScalableBloomFilter(error_rate=0.001),
+                               collected=ScalableBloomFilter(error_rate=0.001))
+    collector.crawl(concurrency=concurrency, per_host=concurrency)
+    return collector
+
+
+MODES = {'serial': serial, 'concurrent': concurrent, 'store': store,
+         'bloom': bloom}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(mode, url, concurrency):
+    """Crawl the site once timed, then again to measure memory"""
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        collector = MODES[mode](url, directory, concurrency)
+        elapsed = time.perf_counter() - start
+        latencies = collector.latencies
+        results = {
+            'pages': len(latencies),
+            'failed': len(collector.failed_links),
+            'links': len(collector.collected_links),
+            'pages/sec': len(latencies) / elapsed,
+            'p50': percentile(latencies, 0.5),
+            'p99': percentile(latencies, 0.99),
+        }
+        del collector
+
+        canonical_url.cache_clear()
+        tracemalloc.start()
+        MODES[mode](url, directory, concurrency)
+        traced = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    # ru_maxrss is in kilobytes on Linux
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return mode, results, traced, rss
+
+
+def megabytes(count):
+    return f'{count / (1 << 20):.1f} MB'
+
+
+def report(mode, results, traced, rss):
+    print(f'{mode}: {results["pages"]} pages, {results["failed"]} failed, '
+          f'{results["links"]} links')
+    print(f'    {"pages/sec":<16}{results["pages/sec"]:>12,.1f}')
+    print(f'    {"fetch p50":<16}{results["p50"] * 1000:>12,.2f} ms')
+    print(f'    {"fetch p99":<16}{results["p99"] * 1000:>12,.2f} ms')
+    print(f'    peak traced {megabytes(traced)}, peak RSS {megabytes(rss)}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_site_arguments(parser)
+    parser.add_argument('--modes', default=','.join(MODES),
+                        help='comma separated crawl modes')
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    with serve(site_from_arguments(args), args.latency) as server:
+        for mode in args.modes.split(','):
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                report(*pool.submit(run, mode, server.url,
+                                    args.concurrency).result())
@@ -1,39 +1,759 @@
-from urllib.request import urlopen
-from urllib.parse import urlparse
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlparse, urlsplit, urlunsplit
+from collections import defaultdict, deque
+from collections.abc import Mapping, MutableSet
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from html.parser import HTMLParser
+import argparse
+import asyncio
+import codecs
+import hashlib
+import http.client
+import math
+import mmap
 import re
+import sqlite3
 import sys
-LINK_REGEX = re.compile(
-    "<a [^>]*href=['\"]([^'\"]+)[^>]*>")
+import tempfile
+import threading
+import time
+# Bytes read from a page per step while extracting links
+CHUNK_SIZE = 1 << 16
+META_CHARSET = re.compile(rb"<meta[^>]+charset=['\"]?([-\w.:]+)", re.IGNORECASE)
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def canonicalize_url(base, href):
+    """The one spelling of the URL href links to from the page at base.
+
+    The scheme and host are lowercased, default ports, fragments and dot
+    segments dropped and the query parameters sorted, so one page is not
+    fetched again under another name. Links that are not http or https are
+    only resolved. Returns None for a link that does not parse, such as one
+    with a bad port or an unclosed IPv6 bracket.
+    """
+    href = href.strip()
+    # Pages share most of their links, so results are cached keyed by only
+    # as much of base as href depends on
+    if '://' in href[:8]:
+        base = ''
+    elif href[:1] not in ('', '?', '#'):
+        base = base.partition('#')[0].partition('?')[0]
+        path_start = base.find('/', base.find('://') + 3)
+        if path_start >= 0:
+            if href[0] == '/' and href[:2] != '//':
+                base = base[:path_start]
+            else:
+                base = base[:base.rfind('/') + 1]
+    try:
+        return canonical_url(base, href)
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=1 << 16)
+def canonical_url(base, href):
+    parts = urlsplit(urljoin(base, href))
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS:
+        return urlunsplit(parts._replace(fragment=''))
+    netloc = (parts.hostname or '').rstrip('.')
+    if ':' in netloc:
+        netloc = f'[{netloc}]'
+    # Raises ValueError for a port out of range or not a number
+    port = parts.port
+    if port and port != DEFAULT_PORTS[scheme]:
+        netloc += f':{port}'
+    if parts.username:
+        password = f':{parts.password}' if parts.password is not None else ''
+        netloc = f'{parts.username}{password}@{netloc}'
+    query = '&'.join(sorted(pair for pair in parts.query.split('&') if pair))
+    return urlunsplit((scheme, netloc, remove_dot_segments(parts.path), query, ''))
+
+
+def remove_dot_segments(path):
+    """Resolve . and .. in path as RFC 3986 says to, never above the root"""
+    segments = []
+    for segment in path.split('/')[1:]:
+        if segment == '..':
+            if segments:
+                segments.pop()
+        elif segment != '.':
+            segments.append(segment)
+    if path.endswith(('/.', '/..')):
+        segments.append('')
+    return '/' + '/'.join(segments)
+
+
+class LinkParser(HTMLParser):
+    """Collects the href of every <a> tag fed to it into links"""
+    def __init__(self):
+        super().__init__()
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            for name, value in attrs:
+                if name == 'href' and value:
+                    self.links.append(value)
+
+
+def extract_links(response, chunk_size=CHUNK_SIZE):
+    """Yield each link in an HTTP response as soon as it has been read.
+
+    The page is decoded with the charset from its Content-Type, or from a
+    <meta> tag near the start, and parsed a chunk at a time, so only the
+    unparsed tail of the page is ever held in memory.
+    """
+    chunk = response.read(chunk_size)
+    charset = response.headers.get_content_charset()
+    if not charset:
+        match = META_CHARSET.search(chunk[:1024])
+        charset = match.group(1).decode('ascii') if match else 'utf-8'
+    try:
+        decoder = codecs.getincrementaldecoder(charset)('replace')
+    except LookupError:
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    parser = LinkParser()
+    while chunk:
+        parser.feed(decoder.decode(chunk))
+        yield from parser.links
+        parser.links.clear()
+        chunk = response.read(chunk_size)
+    parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+    yield from parser.links
+
+
+class ConnectionPool:
+    """Persistent HTTP/1.1 connections, kept per host and shared by threads.
+
+    A connection goes back to the pool after each response unless the server
+    asked to close it. Ones left idle longer than idle_timeout are closed
+    instead of reused, and at most max_idle are kept per host.
+    """
+    CONNECTIONS = {'http': http.client.HTTPConnection,
+                   'https': http.client.HTTPSConnection}
+
+    def __init__(self, timeout=10, idle_timeout=30, max_idle=8, max_redirects=10):
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self.max_redirects = max_redirects
+        # (scheme, host) -> [(time returned to the pool, connection)]
+        self.idle = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        """GET url and return the body"""
+        with self.open(url) as response:
+            return response.read()
+
+    @contextmanager
+    def open(self, url):
+        """GET url, following redirects, and give the response to read.
+
+        The connection returns to the pool once the block is done, if the
+        response was read to the end. Raises HTTPError for error responses,
+        as urlopen does.
+        """
+        for _ in range(self.max_redirects + 1):
+            host, connection, response = self.send(url)
+            try:
+                location = response.getheader('Location')
+                if response.status in (301, 302, 303, 307, 308) and location:
+                    response.read()
+                    url = urljoin(url, location)
+                    continue
+                if response.status >= 400:
+                    raise HTTPError(url, response.status, response.reason,
+                                    response.msg, None)
+                yield response
+                return
+            finally:
+                self.finish(host, connection, response)
+        raise HTTPError(url, response.status, 'too many redirects',
+                        response.msg, None)
+
+    def send(self, url):
+        """Send the request, returning once the response headers are in"""
+        parts = urlsplit(url)
+        host = (parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        while True:
+            connection, reused = self.acquire(host)
+            try:
+                connection.request('GET', path)
+                return host, connection, connection.getresponse()
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                # The server may have dropped a connection that sat idle,
+                # try again on a fresh one
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+
+    def finish(self, host, connection, response):
+        # Unread body left on the connection would corrupt the next response
+        if response.isclosed() and not response.will_close:
+            self.release(host, connection)
+        else:
+            connection.close()
+
+    def acquire(self, host):
+        """Return an idle connection to host, or a new one, and which it is"""
+        now = time.monotonic()
+        with self.lock:
+            idle = self.idle[host]
+            while idle:
+                returned, connection = idle.pop()
+                if now - returned < self.idle_timeout:
+                    return connection, True
+                connection.close()
+        scheme, netloc = host
+        return self.CONNECTIONS[scheme](netloc, timeout=self.timeout), False
+
+    def release(self, host, connection):
+        with self.lock:
+            idle = self.idle[host]
+            if len(idle) < self.max_idle:
+                idle.append((time.monotonic(), connection))
+                return
+        connection.close()
+
+    def close(self):
+        with self.lock:
+            for idle in self.idle.values():
+                for _, connection in idle:
+                    connection.close()
+            self.idle.clear()
+
+class Frontier:
+    """Pages waiting to be crawled, in memory.
+
+    Pages are pushed once, the first time they are seen, and popped in the
+    order they were pushed.
+    """
+    def __init__(self, visited):
+        self.visited = visited
+        self.waiting = deque()
+        # Pages popped so far, whether or not they are done
+        self.taken = 0
+
+    def push(self, url, depth):
+        """Queue url unless it was seen before, returning whether it was"""
+        if url in self.visited:
+            return False
+        self.visited.add(url)
+        self.waiting.append((url, depth))
+        return True
+
+    def pop(self):
+        """The next (url, depth) to crawl, or None if nothing is waiting"""
+        if not self.waiting:
+            return None
+        self.taken += 1
+        return self.waiting.popleft()
+
+    def done(self, url, error=None):
+        pass
+
+    def close(self):
+        pass
+
+
+class FileFrontier(Frontier):
+    """Pages waiting to be crawled, queued in a temporary file.
+
+    Only visited stays in memory, so with a Bloom filter for it the crawl
+    takes the same memory however many pages are waiting.
+    """
+    def __init__(self, visited):
+        self.visited = visited
+        self.waiting = tempfile.TemporaryFile()
+        self.read_at = 0
+        self.count = 0
+        self.taken = 0
+
+    def push(self, url, depth):
+        if url in self.visited:
+            return False
+        self.visited.add(url)
+        self.waiting.seek(0, 2)
+        self.waiting.write(f'{depth} {url}\n'.encode())
+        self.count += 1
+        return True
+
+    def pop(self):
+        if not self.count:
+            return None
+        self.waiting.seek(self.read_at)
+        depth, url = self.waiting.readline().decode().rstrip('\n').split(' ', 1)
+        self.read_at = self.waiting.tell()
+        self.count -= 1
+        self.taken += 1
+        if not self.count:
+            # Everything was read, start the file over
+            self.waiting.truncate(0)
+            self.read_at = 0
+        return url, int(depth)
+
+    def close(self):
+        self.waiting.close()
+
+
+def query_rows(db, query, parameters=(), batch=1000):
+    """Yield the rows of a query a batch at a time, not all at once"""
+    # A cursor of its own, so other statements can run between batches
+    cursor = db.cursor()
+    try:
+        cursor.execute(query, parameters)
+        while rows := cursor.fetchmany(batch):
+            yield from rows
+    finally:
+        cursor.close()
+
+
+class SqliteSet(MutableSet):
+    """A set of strings kept in a column of a sqlite table"""
+    def __init__(self, db, table, column='url', **values):
+        self.db = db
+        self.table = table
+        self.column = column
+        # Other columns to fill in when adding
+        self.values = values
+        self.count = db.execute(f'SELECT count(*) FROM {table}').fetchone()[0]
+
+    def __contains__(self, item):
+        return self.db.execute(
+            f'SELECT 1 FROM {self.table} WHERE {self.column} = ?', (item,)
+        ).fetchone() is not None
+
+    def __iter__(self):
+        for row in query_rows(self.db, f'SELECT {self.column} FROM {self.table}'):
+            yield row[0]
+
+    def __len__(self):
+        return self.count
+
+    def add(self, item):
+        self.insert(item, **self.values)
+
+    def insert(self, item, **values):
+        """Add item with values for other columns, returning if it was new"""
+        columns = ', '.join([self.column, *values])
+        marks = ', '.join('?' * (len(values) + 1))
+        added = self.db.execute(
+            f'INSERT OR IGNORE INTO {self.table} ({columns}) VALUES ({marks})',
+            (item, *values.values())).rowcount
+        self.count += added
+        return bool(added)
+
+    def discard(self, item):
+        self.count -= self.db.execute(
+            f'DELETE FROM {self.table} WHERE {self.column} = ?', (item,)).rowcount
+
+
+class FailedPages(Mapping):
+    """The pages a CrawlStore could not fetch, mapped to the error text"""
+    def __init__(self, db, state):
+        self.db = db
+        self.state = state
+
+    def __getitem__(self, url):
+        row = self.db.execute(
+            'SELECT error FROM pages WHERE url = ? AND state = ?',
+            (url, self.state)).fetchone()
+        if row is None:
+            raise KeyError(url)
+        return row[0]
+
+    def __iter__(self):
+        query = 'SELECT url FROM pages WHERE state = ?'
+        for row in query_rows(self.db, query, (self.state,)):
+            yield row[0]
+
+    def __len__(self):
+        return self.db.execute('SELECT count(*) FROM pages WHERE state = ?',
+                               (self.state,)).fetchone()[0]
+
+    def items(self):
+        query = 'SELECT url, error FROM pages WHERE state = ?'
+        return query_rows(self.db, query, (self.state,))
+
+
+class CrawlStore:
+    """A crawl frontier plus visited and collected links, kept in sqlite.
+
+    Only the pages being crawled are held in memory, so the crawl can grow
+    to millions of URLs. Everything is committed as each page finishes;
+    opening the same file again picks the crawl up where it stopped, pages
+    that were in flight going back to waiting.
+    """
+    WAITING, TAKEN, DONE, FAILED = range(4)
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY, depth INTEGER, state INTEGER, error TEXT
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS waiting_pages ON pages (depth)
+                WHERE state = 0;
+            CREATE TABLE IF NOT EXISTS links (url TEXT PRIMARY KEY) WITHOUT ROWID;
+        ''')
+        self.db.execute('UPDATE pages SET state = ? WHERE state = ?',
+                        (self.WAITING, self.TAKEN))
+        self.db.commit()
+        # Pages added by hand count as visited already
+        self.visited = SqliteSet(self.db, 'pages', depth=0, state=self.DONE)
+        self.collected = SqliteSet(self.db, 'links')
+        self.failed = FailedPages(self.db, self.FAILED)
+        # Pages crawled before, plus those popped since
+        self.taken = self.db.execute('SELECT count(*) FROM pages WHERE state != ?',
+                                     (self.WAITING,)).fetchone()[0]
+
+    def push(self, url, depth):
+        return self.visited.insert(url, depth=depth, state=self.WAITING)
+
+    def pop(self):
+        # Shallowest first, the order an in memory crawl would go in
+        # state written out so the partial index applies
+        row = self.db.execute(
+            'SELECT url, depth FROM pages WHERE state = 0 ORDER BY depth LIMIT 1'
+        ).fetchone()
+        if row:
+            self.db.execute('UPDATE pages SET state = ? WHERE url = ?',
+                            (self.TAKEN, row[0]))
+            self.taken += 1
+        return row
+
+    def done(self, url, error=None):
+        self.db.execute(
+            'UPDATE pages SET state = ?, error = ? WHERE url = ?',
+            (self.FAILED if error else self.DONE,
+             str(error) if error else None, url))
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+class BloomFilter:
+    """Remembers up to capacity strings in a fixed number of bits.
+
+    Membership tests can be wrong the other way, saying a string was added
+    when it was not, about error_rate of the time once full. The bits are a
+    bytearray, or a file mapped into memory if path is given (made afresh,
+    the filter is not read back from it).
+    """
+    def __init__(self, capacity, error_rate=0.001, path=None):
+        self.capacity = capacity
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        length = (self.size + 7) // 8
+        if path is None:
+            self.bits = bytearray(length)
+        else:
+            with open(path, 'w+b') as file:
+                file.truncate(length)
+                self.bits = mmap.mmap(file.fileno(), length)
+
+    def positions(self, item):
+        # Two halves of one hash stand in for all of them
+        digest = hashlib.blake2b(item.encode('utf-8', 'surrogatepass'),
+                                 digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, item):
+        bits = self.bits
+        return all(bits[i >> 3] & 1 << (i & 7) for i in self.positions(item))
+
+    def __len__(self):
+        return self.count
+
+    def add(self, item):
+        """Set item's bits, returning whether any were not set already"""
+        bits = self.bits
+        added = False
+        for i in self.positions(item):
+            mask = 1 << (i & 7)
+            if not bits[i >> 3] & mask:
+                bits[i >> 3] |= mask
+                added = True
+        self.count += added
+        return added
+
+    @property
+    def false_positive_rate(self):
+        """The chance a string never added is reported as present"""
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+    @property
+    def nbytes(self):
+        return len(self.bits)
+
+
+class ScalableBloomFilter:
+    """A BloomFilter that keeps growing, for when the count is not known.
+
+    Each time the newest filter fills up another is started, growth times
+    bigger and with a tighter error rate, so the overall false positive
+    rate stays under error_rate however many strings are added. With path,
+    filter i keeps its bits in the file path.i.
+    """
+    def __init__(self, capacity=1 << 16, error_rate=0.001, growth=2,
+                 tightening=0.5, path=None):
+        self.growth = growth
+        self.tightening = tightening
+        self.path = path
+        self.filters = []
+        self.start(capacity, error_rate * (1 - tightening))
+
+    def start(self, capacity, error_rate):
+        path = None if self.path is None else f'{self.path}.{len(self.filters)}'
+        self.filters.append(BloomFilter(capacity, error_rate, path))
+        self.error_rate = error_rate
+
+    def __contains__(self, item):
+        return any(item in bloom for bloom in self.filters)
+
+    def __len__(self):
+        return sum(len(bloom) for bloom in self.filters)
+
+    def add(self, item):
+        if item in self:
+            return False
+        newest = self.filters[-1]
+        if newest.count >= newest.capacity:
+            self.start(newest.capacity * self.growth,
+                       self.error_rate * self.tightening)
+            newest = self.filters[-1]
+        return newest.add(item)
+
+    @property
+    def false_positive_rate(self):
+        """Estimated from how full each filter is"""
+        miss = 1
+        for bloom in self.filters:
+            miss *= 1 - bloom.false_positive_rate
+        return 1 - miss
+
+    def stats(self):
+        count = len(self)
+        nbytes = sum(bloom.nbytes for bloom in self.filters)
+        return {'items': count, 'filters': len(self.filters), 'bytes': nbytes,
+                'bytes_per_item': nbytes / count if count else 0.0,
+                'false_positive_rate': self.false_positive_rate}
+
+
+class LinkPrinter:
+    """Prints links as they are collected instead of keeping them.
+
+    seen, a ScalableBloomFilter say, remembers which were printed already.
+    """
+    def __init__(self, seen, file=None):
+        self.seen = seen
+        self.file = file
+
+    def __len__(self):
+        return len(self.seen)
+
+    def add(self, link):
+        if link not in self.seen:
+            self.seen.add(link)
+            print(link, file=self.file or sys.stdout)
+
 
 class LinkCollector:
-    def __init__(self, url):
-        self.url = "http://" + urlparse(url).netloc
-        self.collected_links = set()
-        self.visited_links = set()
+    def __init__(self, url, timeout=10, pool=None, store=None, visited=None,
+                 collected=None):
+        """store is a CrawlStore to keep the crawl on disk, resumable.
+
+        visited replaces the set of visited pages, for instance with a
+        ScalableBloomFilter to crawl far more pages in the same memory, at
+        the cost of skipping the odd page it wrongly thinks was visited.
+        Pages waiting to be crawled are then queued in a file, not memory.
+
+        collected replaces the set links are collected into, with anything
+        that has add(), such as a LinkPrinter.
+        """
+        if store and (visited is not None or collected is not None):
+            raise ValueError('a store keeps its own visited and collected links')
+        if '://' not in url:
+            url = 'http://' + url
+        # Same scheme and host, spelt the way canonicalize_url spells links
+        root = canonicalize_url(url, '/')
+        if root is None:
+            raise ValueError(f'bad url {url!r}')
+        self.url = root[:-1]
+        self.store = store
+        if store:
+            self.collected_links = store.collected
+            self.visited_links = store.visited
+            # Read back from the store, which keeps the error text
+            self.failed_links = store.failed
+        else:
+            self.collected_links = set() if collected is None else collected
+            self.visited_links = set() if visited is None else visited
+            # Pages that could not be fetched, and why
+            self.failed_links = {}
+        self.spill_frontier = visited is not None
+        # Shared by every crawler thread, so pages reuse connections
+        self.pool = pool or ConnectionPool(timeout)
         
     def collect_links(self, path="/"):
-        full_url = self.url + path
+        """Collect the links on one page, crawl follows them to the rest"""
+        full_url = self.normalize_url("/", path)
         self.visited_links.add(full_url)
-        page = str(urlopen(full_url).read())
-        links = LINK_REGEX.findall(page)
-        links = {self.normalize_url(path, link) for link in links}
-        self.collected_links = links.union(self.collected_links)
-        unvisited_links = links.difference(self.visited_links)
-        # for link in unvisited_links:
-        #     if link.startswith(self.url):
-        #         self.collect_links(urlparse(link).path)
-    
-    def normalize_url(self, path, link):
-        if link.startswith('http://'):
-            return link
-        elif link.startswith('/'):
-            return self.url + link
+        links = {self.normalize_url(path, link)
+                 for link in self.fetch_links(full_url)}
+        links.discard(None)
+        for link in links:
+            self.collected_links.add(link)
+
+    def fetch_links(self, url):
+        """Yield the links on the page at url while it downloads"""
+        with self.pool.open(url) as response:
+            yield from extract_links(response)
+
+    def crawl(self, max_depth=None, max_pages=None, concurrency=16, per_host=4):
+        """Collect links from every page of the site reachable from /.
+
+        Up to concurrency pages are fetched at once, no more than per_host
+        of them from any one host. Pages more than max_depth links away from
+        / are not fetched, and no more than max_pages pages in all.
+
+        With a store, a crawl that was stopped carries on from where it got
+        to, max_pages counting the pages it crawled before.
+        """
+        asyncio.run(self.crawl_async(max_depth, max_pages, concurrency, per_host))
+
+    async def crawl_async(self, max_depth=None, max_pages=None, concurrency=16,
+                          per_host=4):
+        loop = asyncio.get_running_loop()
+        if self.store:
+            frontier = self.store
+        elif self.spill_frontier:
+            frontier = FileFrontier(self.visited_links)
         else:
-            return self.url + path.rpartition('/')[0] + '/' + link
+            frontier = Frontier(self.visited_links)
+        # Pages handed out to the workers, topped up from the frontier
+        ready = asyncio.Queue()
+        host_slots = defaultdict(lambda: asyncio.Semaphore(per_host))
+
+        def refill():
+            while ready.qsize() < concurrency:
+                # Links past the budget are still queued, for a resumed crawl
+                if max_pages is not None and frontier.taken >= max_pages:
+                    return
+                page = frontier.pop()
+                if page is None:
+                    return
+                ready.put_nowait(page)
+
+        def enqueue(url, depth):
+            if frontier.push(url, depth):
+                refill()
 
+        def found(url, link, depth):
+            link = canonicalize_url(url, link)
+            if link is None:
+                return
+            self.collected_links.add(link)
+            if max_depth is not None and depth >= max_depth:
+                return
+            if link.startswith(self.url + '/'):
+                enqueue(link, depth + 1)
+
+        def fetch(url, depth):
+            # Runs in a thread: links are queued from the event loop as they
+            # are parsed, before the rest of the page has arrived
+            for link in self.fetch_links(url):
+                loop.call_soon_threadsafe(found, url, link, depth)
+
+        async def worker(threads):
+            while True:
+                url, depth = await ready.get()
+                error = None
+                try:
+                    async with host_slots[urlparse(url).netloc]:
+                        await loop.run_in_executor(threads, fetch, url, depth)
+                except Exception as exception:
+                    error = exception
+                    if not self.store:
+                        self.failed_links[url] = exception
+                finally:
+                    frontier.done(url, error)
+                    refill()
+                    ready.task_done()
+
+        # The blocking fetches each get their own thread
+        with ThreadPoolExecutor(concurrency) as threads:
+            enqueue(self.url + '/', 0)
+            refill()
+            workers = [asyncio.create_task(worker(threads))
+                       for _ in range(concurrency)]
+            try:
+                await ready.join()
+            finally:
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                if frontier is not self.store:
+                    frontier.close()
+    
+    def normalize_url(self, path, link):
+        return canonicalize_url(self.url + path, link)
 
 if __name__ == '__main__':
-    collector = LinkCollector(sys.argv[1])
-    collector.collect_links()
-    for link in collector.collected_links:
-        print(link)
+    parser = argparse.ArgumentParser(description='Collect the links on a site')
+    parser.add_argument('url')
+    parser.add_argument('--crawl', action='store_true',
+                        help='follow links to every page on the site')
+    parser.add_argument('--depth', type=int, default=None)
+    parser.add_argument('--pages', type=int, default=None)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--per-host', type=int, default=4)
+    parser.add_argument('--store', metavar='FILE',
+                        help='sqlite file to keep the crawl in, and resume it from')
+    parser.add_argument('--bloom', type=float, metavar='ERROR_RATE',
+                        help='track visited pages in a Bloom filter')
+    args = parser.parse_args()
+    if args.store and args.bloom:
+        parser.error('--store keeps visited pages on disk, drop --bloom')
+
+    store = CrawlStore(args.store) if args.store else None
+    visited = collected = None
+    if args.bloom:
+        # Links are printed as they turn up rather than kept to the end
+        visited = ScalableBloomFilter(error_rate=args.bloom)
+        collected = LinkPrinter(ScalableBloomFilter(error_rate=args.bloom))
+    collector = LinkCollector(args.url, store=store, visited=visited,
+                              collected=collected)
+    if args.crawl:
+        collector.crawl(args.depth, args.pages, args.concurrency, args.per_host)
+    else:
+        collector.collect_links()
+    if collected is None:
+        for link in collector.collected_links:
+            print(link)
+    for link, error in collector.failed_links.items():
+        print(f'{link}: {error}', file=sys.stderr)
+    if store:
+        store.close()
+    if visited:
+        print(visited.stats(), file=sys.stderr)
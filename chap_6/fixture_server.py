@@ -0,0 +1,157 @@
+"""A made up website on localhost, for exercising the LinkCollector crawler.
+
+The pages in case_study_web are served as they are, at their own names,
+each with links into a synthetic site of numbered pages appended. Every
+numbered page links to fan_out others picked at random (the same ones on
+every run with the same seed) and is padded out to page_size bytes. A
+share of the numbered pages, error_rate, fail with a 500, and every
+response is held back by latency seconds. Run it on its own with
+
+    python fixture_server.py --pages 10000 --latency 0.02
+"""
+import argparse
+import random
+import socket
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+SEED_DIRECTORY = Path(__file__).parent / 'case_study_web'
+
+
+class SiteGraph:
+    def __init__(self, pages=1000, fan_out=8, page_size=4096, error_rate=0.0,
+                 seed=0, seed_directory=SEED_DIRECTORY):
+        self.pages = pages
+        self.fan_out = fan_out
+        self.page_size = page_size
+        self.error_rate = error_rate
+        self.seed = seed
+        self.seed_pages = {path.name: path.read_text()
+                           for path in Path(seed_directory).glob('*.html')}
+
+    def links(self, number):
+        rng = random.Random(self.seed * 1_000_003 + number)
+        # Always link on to the next page, so the whole site is reachable
+        numbers = [(number + 1) % self.pages]
+        numbers += [rng.randrange(self.pages) for _ in range(self.fan_out - 1)]
+        return [f'/site/{n}.html' for n in numbers]
+
+    def fails(self, number):
+        # Hashed rather than drawn, so a page fails on every request or none
+        key = f'{self.seed}:{number}'.encode()
+        return zlib.crc32(key) / 0xFFFFFFFF < self.error_rate
+
+    def page(self, path):
+        """Return (status, body) for a request path"""
+        name = path.partition('?')[0].lstrip('/') or 'index.html'
+        if name in self.seed_pages:
+            links = ''.join(f'<a href="{link}">{link}</a>\n'
+                            for link in self.links(0))
+            html = self.seed_pages[name] or '<html>\n <body>\n </body>\n</html>'
+            head, found, tail = html.rpartition('</body>')
+            return 200, (head + links + found + tail if found else html + links)
+        number = name.removeprefix('site/').removesuffix('.html')
+        if not (name.startswith('site/') and number.isdigit()
+                and int(number) < self.pages):
+            return 404, '<html><body>Not found</body></html>'
+        number = int(number)
+        if self.fails(number):
+            return 500, '<html><body>Server error</body></html>'
+        body = ''.join(f' <a href="{link}">Page {link}</a>\n'
+                       for link in self.links(number))
+        html = f'<html>\n<body>\n <h1>Page {number}</h1>\n{body}'
+        padding = max(0, self.page_size - len(html) - len('</body>\n</html>\n'))
+        return 200, f'{html}<p>{"x" * max(0, padding - 7)}</p>\n</body>\n</html>\n'
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in one write, but small responses on a
+        # kept alive connection still wait on Nagle without this
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_GET(self):
+        site = self.server.site
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        status, html = site.page(self.path)
+        body = html.encode()
+        head = (f'HTTP/1.1 {status} {self.responses[status][0]}\r\n'
+                f'Content-Type: text/html; charset=utf-8\r\n'
+                f'Content-Length: {len(body)}\r\n\r\n')
+        self.wfile.write(head.encode('latin-1') + body)
+        with self.server.lock:
+            self.server.requests += 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Crawlers open a lot of connections at once
+    request_queue_size = 128
+
+    def __init__(self, site, latency=0.0, address=('127.0.0.1', 0)):
+        super().__init__(address, FixtureHandler)
+        self.site = site
+        self.latency = latency
+        # Handlers run on threads of their own, so counting takes the lock
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+@contextmanager
+def serve(site=None, latency=0.0, address=('127.0.0.1', 0)):
+    """Run a FixtureServer in a thread for the length of the block"""
+    server = FixtureServer(site or SiteGraph(), latency, address)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def add_site_arguments(parser):
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--fan-out', type=int, default=8)
+    parser.add_argument('--page-size', type=int, default=4096)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds to hold back each response')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def site_from_arguments(args):
+    return SiteGraph(args.pages, args.fan_out, args.page_size, args.error_rate,
+                     args.seed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_site_arguments(parser)
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    server = FixtureServer(site_from_arguments(args), args.latency,
+                           ('127.0.0.1', args.port))
+    print(f'Serving {args.pages} pages at {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,224 @@
+import http.client
+import importlib.util
+import logging
+import sqlite3
+import subprocess
+import sys
+import time
+from collections import deque
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import pytest
+
+from fixture_server import SiteGraph, serve
+
+
+def load_module(name, filename):
+    # chap_5 has a case_study module too, so import this one under its own name
+    spec = importlib.util.spec_from_file_location(
+        name, Path(__file__).with_name(filename))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+case_study = load_module('chap_6_case_study', 'case_study.py')
+BloomFilter = case_study.BloomFilter
+ConnectionPool = case_study.ConnectionPool
+CrawlStore = case_study.CrawlStore
+LinkCollector = case_study.LinkCollector
+LinkParser = case_study.LinkParser
+ScalableBloomFilter = case_study.ScalableBloomFilter
+canonicalize_url = case_study.canonicalize_url
+
+
+def page(site, url):
+    parts = urlsplit(url)
+    return site.page(parts.path + ('?' + parts.query if parts.query else ''))
+
+
+def site_pages(site, root, max_depth=None):
+    """Every page a crawl from root should fetch, walking the site directly"""
+    depths = {root + '/': 0}
+    queue = deque(depths)
+    while queue:
+        url = queue.popleft()
+        status, html = page(site, url)
+        depth = depths[url]
+        if status != 200 or (max_depth is not None and depth >= max_depth):
+            continue
+        parser = LinkParser()
+        parser.feed(html)
+        for link in parser.links:
+            link = canonicalize_url(url, link)
+            if link and link.startswith(root + '/') and link not in depths:
+                depths[link] = depth + 1
+                queue.append(link)
+    return set(depths)
+
+
+def finished_pages(path):
+    db = sqlite3.connect(path)
+    try:
+        return {url for url, in db.execute(
+            'SELECT url FROM pages WHERE state IN (?, ?)',
+            (CrawlStore.DONE, CrawlStore.FAILED))}
+    except sqlite3.OperationalError:
+        # The crawler has not made the tables yet
+        return set()
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('http://Example.COM:80/a/./b/../c', 'http://example.com/a/c'),
+    ('https://example.com:443/x?b=2&a=1#top', 'https://example.com/x?a=1&b=2'),
+    ('http://example.com:8080/../../x', 'http://example.com:8080/x'),
+    ('http://example.com./a/b/..', 'http://example.com/a/'),
+    ('http://[::1]:8000/p?&z&a', 'http://[::1]:8000/p?a&z'),
+    ('http://[2001:DB8::1]/', 'http://[2001:db8::1]/'),
+    ('mailto:someone@example.com', 'mailto:someone@example.com'),
+])
+def test_canonicalize(url, expected):
+    assert canonicalize_url('http://base.com/dir/page.html', url) == expected
+
+
+def test_canonicalize_relative():
+    base = 'http://example.com/dir/page.html?q=1'
+    assert canonicalize_url(base, 'other.html') == 'http://example.com/dir/other.html'
+    assert canonicalize_url(base, '../up.html') == 'http://example.com/up.html'
+    assert canonicalize_url(base, '/root.html') == 'http://example.com/root.html'
+    assert canonicalize_url(base, '?b=2&a=1') == 'http://example.com/dir/page.html?a=1&b=2'
+    assert canonicalize_url(base, '//other.com/x') == 'http://other.com/x'
+
+
+@pytest.mark.parametrize('url', [
+    'http://[::1', 'http://example.com:99999/', 'http://example.com:abc/x',
+])
+def test_canonicalize_rejects_bad_links(url):
+    assert canonicalize_url('http://base.com/', url) is None
+
+
+def test_crawl_depth_limit():
+    site = SiteGraph(300, error_rate=0.05)
+    with serve(site) as server:
+        collector = LinkCollector(server.url)
+        collector.crawl(max_depth=2, concurrency=4)
+    pages = site_pages(site, server.url, 2)
+    assert collector.visited_links == pages
+    assert set(collector.failed_links) == {
+        url for url in pages if page(site, url)[0] != 200}
+
+
+def test_crawl_page_limit():
+    with serve(SiteGraph(300)) as server:
+        collector = LinkCollector(server.url)
+        collector.crawl(max_pages=30, concurrency=8)
+        assert server.requests == 30
+
+
+def test_bad_links_are_skipped(tmp_path, caplog):
+    (tmp_path / 'index.html').write_text(
+        '<html><body><a href="http://[::1">bad</a>'
+        '<a href="/x.html:99999">fine</a>'
+        '<a href="http://localhost:99999/">bad port</a></body></html>')
+    site = SiteGraph(20, seed_directory=tmp_path)
+    with serve(site) as server:
+        collector = LinkCollector(server.url)
+        collector.collect_links()
+        assert server.url + '/x.html:99999' in collector.collected_links
+        assert None not in collector.collected_links
+        with caplog.at_level(logging.ERROR):
+            collector = LinkCollector(server.url)
+            collector.crawl(concurrency=2)
+    assert not caplog.records
+    assert collector.visited_links == site_pages(site, server.url)
+
+
+def test_resume_after_page_budget(tmp_path):
+    path = tmp_path / 'crawl.db'
+    site = SiteGraph(200, error_rate=0.05)
+    with serve(site) as server:
+        store = CrawlStore(path)
+        LinkCollector(server.url, store=store).crawl(max_pages=50)
+        store.close()
+        assert len(finished_pages(path)) == 50
+        store = CrawlStore(path)
+        collector = LinkCollector(server.url, store=store)
+        collector.crawl()
+        failed = dict(collector.failed_links.items())
+        store.close()
+        expected = site_pages(site, server.url)
+        # No page was fetched twice
+        assert server.requests == len(expected)
+    assert finished_pages(path) == expected
+    assert set(failed) == {url for url in expected if page(site, url)[0] != 200}
+    assert any('500' in error for error in failed.values())
+
+
+def test_resume_after_kill(tmp_path):
+    path = tmp_path / 'crawl.db'
+    site = SiteGraph(200)
+    with serve(site, latency=0.005) as server:
+        crawler = subprocess.Popen(
+            [sys.executable, 'case_study.py', server.url, '--crawl',
+             '--store', str(path), '--concurrency', '2'],
+            cwd=Path(__file__).parent, stdout=subprocess.DEVNULL)
+        try:
+            deadline = time.monotonic() + 30
+            while time.monotonic() < deadline:
+                if path.exists() and len(finished_pages(path)) >= 20:
+                    break
+                time.sleep(0.05)
+        finally:
+            crawler.kill()
+            crawler.wait()
+        assert 20 <= len(finished_pages(path)) < 200
+        store = CrawlStore(path)
+        LinkCollector(server.url, store=store).crawl()
+        store.close()
+    assert finished_pages(path) == site_pages(site, server.url)
+
+
+class CountingConnection(http.client.HTTPConnection):
+    opened = 0
+
+    def connect(self):
+        CountingConnection.opened += 1
+        super().connect()
+
+
+def test_connections_are_reused():
+    pool = ConnectionPool()
+    pool.CONNECTIONS = {'http': CountingConnection}
+    CountingConnection.opened = 0
+    with serve(SiteGraph(20)) as server:
+        bodies = [pool.get(f'{server.url}/site/{number}.html')
+                  for number in range(10)]
+        assert server.requests == 10
+    pool.close()
+    assert all(b'<h1>Page' in body for body in bodies)
+    assert CountingConnection.opened == 1
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(1000, error_rate=0.01)
+    words = [f'word {number}' for number in range(1000)]
+    for word in words:
+        bloom.add(word)
+    assert all(word in bloom for word in words)
+    wrong = sum(f'other {number}' in bloom for number in range(10000))
+    assert wrong < 300
+
+
+def test_scalable_bloom_filter_grows():
+    bloom = ScalableBloomFilter(capacity=100, error_rate=0.01)
+    words = [f'word {number}' for number in range(5000)]
+    for word in words:
+        bloom.add(word)
+    assert len(bloom.filters) > 1
+    assert all(word in bloom for word in words)
+    wrong = sum(f'other {number}' in bloom for number in range(10000))
+    assert wrong < 300